@@ -7,6 +7,7 @@ Run:  python app.py
 
 from __future__ import annotations
 
+import html
 import os
 import sys
 
@@ -21,19 +22,19 @@ os.chdir(SERVER_DIR)
 import gradio as gr
 
 # ── Model loading ─────────────────────────────────────────────────────────────
-_model_loaded = False
 _model_error: str | None = None
-_mesh_dict = _model = _tokenizer = _retriever = _look_up = _model_w2v = None
+_loader = None
 
 try:
-    from suggest_mesh_terms import Suggest_MeSH_Terms_With_BERT, prepare_model
+    from suggest_mesh_terms import Suggest_MeSH_Terms_With_BERT
     from suggest_with_other import ATM_MeSH_Suggestion
     from query_parser import parse_boolean_query
+    from resources import TYPE_COMPONENTS, ResourceLoader
 
-    print("Loading models …", flush=True)
-    _mesh_dict, _model, _tokenizer, _retriever, _look_up, _model_w2v = prepare_model()
-    _model_loaded = True
-    print("Models loaded successfully.", flush=True)
+    print("Loading models in the background …", flush=True)
+    # models, index, micro-batching scheduler and cache, shared by every Gradio click;
+    # the UI (and ATM) is up right away, BERT methods wait for the components they need
+    _loader = ResourceLoader().start()
 except Exception as _e:
     _model_error = str(_e)
     print(f"Warning: could not load BERT models — {_e}", flush=True)
@@ -99,83 +100,159 @@ def _empty_groups_html():
 
 
 # ── MeSH suggestion ───────────────────────────────────────────────────────────
+_TYPE_MAP = {
+    "Semantic-BERT": "Semantic",
+    "Fragment-BERT": "Fragment",
+    "Atomic-BERT": "Atomic",
+    "ATM": "ATM",
+}
+
+
+_METHOD_NAMES = {mesh_type: method for method, mesh_type in _TYPE_MAP.items()}
+
+
+def _load_failures(mesh_type: str) -> list[str]:
+    """`component: error` for each component `mesh_type` needs that failed to load."""
+    if mesh_type == "ATM":
+        return []
+    if _loader is None:
+        return [_model_error or "Model files not found."]
+    return [
+        f"{name}: {_loader.status[name].get('error')}"
+        for name in TYPE_COMPONENTS[mesh_type]
+        if _loader.status[name]["status"] == "failed"
+    ]
+
+
+def _wait_for_models(mesh_type: str):
+    failures = _load_failures(mesh_type)
+    if failures:
+        raise RuntimeError("failed to load " + "; ".join(failures))
+    if mesh_type != "ATM":
+        _loader.wait(TYPE_COMPONENTS[mesh_type])
+
+
+def _status_html() -> str:
+    """Loading state of the background loader: what is still loading, what failed and which methods that affects."""
+    if _loader is None:
+        return (
+            f"<div style='padding:12px 16px;background:#fefce8;"
+            f"border:1px solid #fde047;border-radius:10px;"
+            f"color:#854d0e;font-size:13px;margin-bottom:4px'>"
+            f"⚠ <b>BERT models not loaded</b>"
+            f"{' — ' + html.escape(_model_error) if _model_error else ''}. "
+            f"Run <code>python download_models.py</code> to download them. "
+            f"<b>ATM</b> still works without local models.</div>"
+        )
+    report = _loader.report()
+    if report["ready"]:
+        return ""
+
+    lines = []
+    for name, status in report["components"].items():
+        if status["status"] == "failed":
+            affected = [_METHOD_NAMES[t] for t in _METHOD_NAMES if t != "ATM" and name in TYPE_COMPONENTS[t]]
+            lines.append(
+                f"❌ <b>{name}</b> failed to load: {html.escape(str(status.get('error')))}"
+                + (f" — <b>{', '.join(affected)}</b> unavailable." if affected else "")
+            )
+    waiting = {
+        _METHOD_NAMES[t]: _loader.missing(t)
+        for t in _METHOD_NAMES
+        if t != "ATM" and _loader.missing(t) and not _load_failures(t)
+    }
+    for method, missing in waiting.items():
+        lines.append(f"⏳ <b>{method}</b> waits for {', '.join(missing)} to load.")
+    if not lines:
+        return ""
+    return (
+        f"<div style='padding:12px 16px;background:#fefce8;"
+        f"border:1px solid #fde047;border-radius:10px;"
+        f"color:#854d0e;font-size:13px;margin-bottom:4px;line-height:1.7'>"
+        + "<br/>".join(lines)
+        + "</div>"
+    )
+
+
+def _suggest_terms(groups: list, mesh_type: str) -> list[dict]:
+    all_results: list[dict] = []
+    for i, group in enumerate(groups):
+        if mesh_type == "ATM":
+            params = {"payload": {"Keywords": group, "Type": "ATM"}}
+            suggestions = ATM_MeSH_Suggestion(params).suggest()
+        else:
+            params = {
+                "payload": {"Keywords": group, "Type": mesh_type},
+                **_loader.resources,
+            }
+            suggestions = Suggest_MeSH_Terms_With_BERT(params).suggest()
+        terms: list[str] = []
+        seen: set[str] = set()
+        for item in suggestions:
+            for t in item.get("MeSH_Terms", {}).values():
+                if t not in seen:
+                    seen.add(t)
+                    terms.append(t)
+        all_results.append({"group_idx": i, "keywords": group, "terms": terms})
+    return all_results
+
+
 def _suggest(groups: list, method: str):
     if not groups:
-        return _placeholder_results(), []
+        return _placeholder_results(), gr.update(choices=[], value=[]), []
 
-    bert_methods = {"Semantic-BERT", "Fragment-BERT", "Atomic-BERT"}
-    if method in bert_methods and not _model_loaded:
-        msg = _model_error or "Model files not found."
+    mesh_type = _TYPE_MAP[method]
+    try:
+        _wait_for_models(mesh_type)
+    except Exception as exc:
+        msg = str(exc) or "Model files not found."
         return (
             f"<div style='"
             f"padding:14px 18px;background:#fefce8;border:1px solid #fde047;"
             f"border-radius:10px;color:#854d0e;font-size:14px'>"
-            f"<b>⚠ BERT models not loaded</b> — {msg}<br/>"
+            f"<b>⚠ {method} unavailable</b> — {html.escape(msg)}<br/>"
             f"<span style='font-size:13px'>Run <code>python download_models.py</code> "
             f"or switch to the <b>ATM</b> method.</span></div>",
+            gr.update(choices=[], value=[]),
             [],
         )
 
-    type_map = {
-        "Semantic-BERT": "Semantic",
-        "Fragment-BERT": "Fragment",
-        "Atomic-BERT": "Atomic",
-        "ATM": "ATM",
-    }
-    mesh_type = type_map[method]
-    all_results: list[dict] = []
-    all_checkboxes: list[tuple[str, str]] = []
-
     try:
-        for i, group in enumerate(groups):
-            if mesh_type == "ATM":
-                params = {"payload": {"Keywords": group, "Type": "ATM"}}
-                suggestions = ATM_MeSH_Suggestion(params).suggest()
-                terms: list[str] = []
-                seen: set[str] = set()
-                for item in suggestions:
-                    for t in item.get("MeSH_Terms", {}).values():
-                        if t not in seen:
-                            seen.add(t)
-                            terms.append(t)
-            else:
-                params = {
-                    "payload": {"Keywords": group, "Type": mesh_type},
-                    "mesh_dict": _mesh_dict,
-                    "model": _model,
-                    "tokenizer": _tokenizer,
-                    "retriever": _retriever,
-                    "look_up": _look_up,
-                    "model_w2v": _model_w2v,
-                }
-                raw = Suggest_MeSH_Terms_With_BERT(params).suggest()
-                terms = []
-                seen = set()
-                for r in raw:
-                    for t in r.get("MeSH_Terms", {}).values():
-                        if t not in seen:
-                            seen.add(t)
-                            terms.append(t)
-
-            for t in terms:
-                label = f"[F{i + 1}]  {t}"
-                all_checkboxes.append((label, f"{i}::{t}"))
-            all_results.append({"group_idx": i, "keywords": group, "terms": terms})
-
+        all_results = _suggest_terms(groups, mesh_type)
     except Exception as exc:
         return (
             f"<div style='"
             f"padding:14px 18px;background:#fef2f2;border:1px solid #fca5a5;"
             f"border-radius:10px;color:#991b1b;font-size:14px'>"
-            f"❌ <b>Error:</b> {exc}</div>",
+            f"❌ <b>Error:</b> {html.escape(str(exc))}</div>",
+            gr.update(choices=[], value=[]),
             [],
         )
 
+    all_checkboxes: list[tuple[str, str]] = []
+    for r in all_results:
+        for t in r["terms"]:
+            label = f"[F{r['group_idx'] + 1}]  {t}"
+            all_checkboxes.append((label, f"{r['group_idx']}::{t}"))
+
     cards_html = _build_cards(all_results, groups)
     choices = [c[0] for c in all_checkboxes]
     return cards_html, gr.update(choices=choices, value=[]), all_checkboxes
 
 
+def _api_suggest(text: str, method: str) -> list[dict]:
+    """Parse + suggest in one call, for scripted clients (the UI keeps the groups in session state)."""
+    groups = parse_boolean_query(text) if text and text.strip() else []
+    mesh_type = _TYPE_MAP.get(method)
+    if mesh_type is None:
+        raise gr.Error(f"Unknown method: {method}")
+    try:
+        _wait_for_models(mesh_type)
+        return _suggest_terms(groups, mesh_type)
+    except Exception as exc:
+        raise gr.Error(str(exc) or "Model files not found.")
+
+
 def _build_cards(results: list[dict], groups: list[list[str]]) -> str:
     if not results:
         return _placeholder_results()
@@ -337,16 +414,8 @@ with gr.Blocks(theme=_theme, css=_CSS, title="MeSH Term Suggester") as demo:
     </div>
     """)
 
-    if not _model_loaded:
-        gr.HTML(
-            f"<div style='padding:12px 16px;background:#fefce8;"
-            f"border:1px solid #fde047;border-radius:10px;"
-            f"color:#854d0e;font-size:13px;margin-bottom:4px'>"
-            f"⚠ <b>BERT models not loaded</b>"
-            f"{' — ' + _model_error if _model_error else ''}. "
-            f"Run <code>python download_models.py</code> to download them. "
-            f"<b>ATM</b> still works without local models.</div>"
-        )
+    # loading / failed components; refreshed on page load and after each suggestion
+    status_html = gr.HTML(value=_status_html())
 
     # State
     groups_state = gr.State([])
@@ -410,7 +479,7 @@ with gr.Blocks(theme=_theme, css=_CSS, title="MeSH Term Suggester") as demo:
         fn=_suggest,
         inputs=[groups_state, method_dropdown],
         outputs=[results_html, results_checkboxes, checkboxes_state],
-    )
+    ).then(fn=_status_html, inputs=[], outputs=[status_html])
 
     add_btn.click(
         fn=_add_terms,
@@ -418,6 +487,16 @@ with gr.Blocks(theme=_theme, css=_CSS, title="MeSH Term Suggester") as demo:
         outputs=[query_builder],
     )
 
+    # API only (`/suggest`): used by load tests, e.g. `python -m benchmark.loadtest --gradio`
+    api_results = gr.JSON(visible=False)
+    api_btn = gr.Button(visible=False)
+    api_btn.click(
+        fn=_api_suggest,
+        inputs=[query_input, method_dropdown],
+        outputs=[api_results],
+        api_name="suggest",
+    )
+
     clear_btn.click(
         fn=_clear,
         inputs=[],
@@ -427,6 +506,8 @@ with gr.Blocks(theme=_theme, css=_CSS, title="MeSH Term Suggester") as demo:
         ],
     )
 
+    demo.load(fn=_status_html, inputs=[], outputs=[status_html])
+
 # ── Launch ────────────────────────────────────────────────────────────────────
 if __name__ == "__main__":
     import argparse
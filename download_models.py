@@ -7,6 +7,8 @@ Models:
      → server/Model/checkpoint-80000/
   2. PubMed-w2v.bin   -- HF Hub (preferred) OR Google Drive direct file (fallback)
      → server/Model/PubMed-w2v.bin
+     then converted once to a memory-mappable gensim store
+     → server/Model/PubMed-w2v.kv
 
 Run from the repository root:
     python download_models.py
@@ -21,6 +23,7 @@ ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(ROOT_DIR, "server", "Model")
 BERT_DEST = os.path.join(MODEL_DIR, "checkpoint-80000")
 W2V_DEST = os.path.join(MODEL_DIR, "PubMed-w2v.bin")
+W2V_KV_DEST = os.path.join(MODEL_DIR, "PubMed-w2v.kv")
 
 # ── Sources ────────────────────────────────────────────────────────────────────
 HF_REPO_ID = "ielabgroup/mesh_term_suggestion_biobert"
@@ -42,7 +45,7 @@ def download_bert_checkpoint() -> None:
         sys.exit(1)
 
     _ensure_dir(BERT_DEST)
-    print(f"[1/2] Downloading BERT checkpoint from HF Hub ({HF_REPO_ID}) …")
+    print(f"[1/3] Downloading BERT checkpoint from HF Hub ({HF_REPO_ID}) …")
     snapshot_download(
         repo_id=HF_REPO_ID,
         local_dir=BERT_DEST,
@@ -66,7 +69,7 @@ def download_w2v() -> None:
     from huggingface_hub.utils import EntryNotFoundError, RepositoryNotFoundError
 
     _ensure_dir(MODEL_DIR)
-    print("[2/2] Downloading PubMed-w2v.bin …")
+    print("[2/3] Downloading PubMed-w2v.bin …")
 
     # ── attempt 1: HF Hub ──────────────────────────────────────────────────
     try:
@@ -106,6 +109,17 @@ def download_w2v() -> None:
     print(f"      ✓ Saved to {W2V_DEST}")
 
 
+# ── Memory-mappable word2vec store ────────────────────────────────────────────
+def convert_w2v() -> None:
+    """Convert PubMed-w2v.bin to gensim's native format so the server can mmap it."""
+    sys.path.insert(0, os.path.join(ROOT_DIR, "server"))
+    from w2v_store import convert_word2vec
+
+    print("[3/3] Converting PubMed-w2v.bin to a memory-mappable store …")
+    convert_word2vec(W2V_DEST, W2V_KV_DEST)
+    print(f"      ✓ Saved to {W2V_KV_DEST}")
+
+
 # ── Entry point ────────────────────────────────────────────────────────────────
 def main() -> None:
     _ensure_dir(MODEL_DIR)
@@ -113,19 +127,26 @@ def main() -> None:
     # 1. BERT checkpoint
     bert_marker = os.path.join(BERT_DEST, "pytorch_model.bin")
     if os.path.exists(bert_marker):
-        print(f"[1/2] BERT checkpoint already present — skipping.")
+        print(f"[1/3] BERT checkpoint already present — skipping.")
     else:
         download_bert_checkpoint()
 
     # 2. PubMed word2vec
     if os.path.exists(W2V_DEST):
-        print(f"[2/2] PubMed-w2v.bin already present — skipping.")
+        print(f"[2/3] PubMed-w2v.bin already present — skipping.")
     else:
         download_w2v()
 
+    # 3. mmap-able word2vec store
+    if os.path.exists(W2V_KV_DEST):
+        print(f"[3/3] PubMed-w2v.kv already present — skipping.")
+    else:
+        convert_w2v()
+
     print("\n✅ All models ready.")
     print(f"   {BERT_DEST}")
     print(f"   {W2V_DEST}")
+    print(f"   {W2V_KV_DEST}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,273 @@
+"""
+Async (ASGI) server mode.
+
+Serves the same `/api/v1/resources/mesh` contract as main.py, plus a streaming
+variant, `/api/v1/resources/mesh/stream`, that sends each keyword/group result as soon
+as it is computed: NDJSON by default (first line `{"Splits": [...]}`, then one result
+per line), or Server-Sent Events with `format=sse`. `POST /api/v1/resources/mesh/bulk`
+takes a JSONL body of queries and streams one JSONL result per query (see
+bulk_suggest.py). Model inference and remote lookups run in a thread pool so the event
+loop can hold many open connections.
+
+Components load in the background (see resources.py): `/health` and `/ready` report
+their status, and suggestion requests get a 503 until their type's components are in.
+SIGUSR1 swaps in the index, lookup and MeSH terms written by index_update.py.
+`/metrics` and the Server-Timing header are recorded as in main.py (see metrics.py).
+
+    python asgi.py --host 127.0.0.1 --port 5000
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from starlette.applications import Starlette
+from starlette.datastructures import MutableHeaders, QueryParams
+from starlette.middleware import Middleware
+from starlette.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+
+import metrics
+from bulk_suggest import BULK_TYPES, bulk_suggest, read_queries
+from index_update import reload_in_background
+from suggest_mesh_terms import FUSION_METHODS
+from resources import SUGGESTION_TYPES, ResourceLoader, create_engine
+from suggest_engine import load_config
+
+CORS_HEADERS = {'Access-Control-Allow-Origin': '*'}
+_DONE = object()
+
+config = load_config()
+executor = ThreadPoolExecutor(max_workers=config.get("asgi", {}).get("executor_workers", 8),
+                              thread_name_prefix="suggest")
+loader = None
+resources = None
+server_timing = config.get("metrics", {}).get("server_timing", True)
+
+
+class RequestMetrics:
+    """
+    ASGI middleware recording what main.py records around every suggestion request: the
+    `request` stage, the request counter and (unless disabled) a Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/v1/resources/mesh"):
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        timings = metrics.start_request()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            recorded = True
+            seconds = time.perf_counter() - start
+            metrics.registry.observe_stage("request", seconds)
+            type = QueryParams(scope.get("query_string", b"")).get("type")
+            metrics.registry.count_request(metrics.request_label(type, SUGGESTION_TYPES), status)
+            return seconds
+
+        async def send_with_metrics(message):
+            if message["type"] == "http.response.start" and not recorded:
+                seconds = record(message["status"])
+                if server_timing:
+                    MutableHeaders(scope=message).append(
+                        "Server-Timing", metrics.server_timing({**timings, "request": seconds}))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            if not recorded:
+                # the error middleware outside this one answers 500
+                record(500)
+            metrics.end_request()
+
+
+def _run(func, *args):
+    """Run `func` in the executor in the request's context, so its stages reach Server-Timing."""
+    return asyncio.get_running_loop().run_in_executor(executor, contextvars.copy_context().run, func, *args)
+
+
+def _not_ready(type):
+    missing = loader.missing(type)
+    if not missing:
+        return None
+    return JSONResponse({"Error": f"Not ready for {type} suggestions", "Waiting": missing}, status_code=503,
+                        headers={**CORS_HEADERS, 'Retry-After': '5'})
+
+
+def _invalid_fusion(fusion):
+    if not fusion or fusion in FUSION_METHODS:
+        return None
+    return JSONResponse({"Error": f"Fusion method not valid: {fusion}"}, status_code=400, headers=CORS_HEADERS)
+
+
+def _payload(request):
+    terms = request.query_params.get("term", "")
+    split_terms = terms.split("$")
+    payload = {
+        "Keywords": split_terms,
+        "Type": request.query_params.get("type"),
+        "Fusion": request.query_params.get("fusion")
+    }
+    return split_terms, payload
+
+
+async def get_mesh(request):
+    split_terms, payload = _payload(request)
+    invalid = _invalid_fusion(payload["Fusion"])
+    if invalid is not None:
+        return invalid
+    unavailable = _not_ready(payload["Type"])
+    if unavailable is not None:
+        return unavailable
+    engine = create_engine(resources, payload)
+    response = await _run(engine.suggest) if engine is not None else None
+    formatted_response = {
+        "Splits": split_terms,
+        "Data": response
+    }
+    return JSONResponse(formatted_response, headers=CORS_HEADERS)
+
+
+async def stream_mesh(request):
+    split_terms, payload = _payload(request)
+    invalid = _invalid_fusion(payload["Fusion"])
+    if invalid is not None:
+        return invalid
+    unavailable = _not_ready(payload["Type"])
+    if unavailable is not None:
+        return unavailable
+    engine = create_engine(resources, payload)
+    sse = request.query_params.get("format") == "sse"
+
+    def encode(item):
+        line = json.dumps(item)
+        return f"data: {line}\n\n" if sse else line + "\n"
+
+    async def body():
+        yield encode({"Splits": split_terms})
+        if engine is None:
+            return
+        results = engine.iter_suggest()
+        while True:
+            try:
+                item = await _run(next, results, _DONE)
+            except Exception as e:
+                # the status line is already sent: report the failure in-band and end the stream
+                yield encode({"Error": str(e)})
+                break
+            if item is _DONE:
+                break
+            yield encode(item)
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(body(), media_type=media_type, headers=CORS_HEADERS)
+
+
+async def bulk_mesh(request):
+    type = request.query_params.get("type", "Fragment")
+    if type not in BULK_TYPES:
+        return JSONResponse({"Error": f"Type not valid for bulk suggestion: {type}"}, status_code=400,
+                            headers=CORS_HEADERS)
+    fusion = request.query_params.get("fusion")
+    invalid = _invalid_fusion(fusion)
+    if invalid is not None:
+        return invalid
+    unavailable = _not_ready(type)
+    if unavailable is not None:
+        return unavailable
+    body = (await request.body()).decode("utf-8")
+    try:
+        entries = list(read_queries(body.splitlines()))
+    except ValueError as e:
+        return JSONResponse({"Error": str(e)}, status_code=400, headers=CORS_HEADERS)
+
+    async def lines():
+        results = bulk_suggest(entries, resources, type=type, fusion=fusion)
+        while True:
+            try:
+                item = await _run(next, results, _DONE)
+            except Exception as e:
+                yield json.dumps({"Error": str(e)}) + "\n"
+                break
+            if item is _DONE:
+                break
+            yield json.dumps(item) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=CORS_HEADERS)
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", **loader.report()})
+
+
+async def ready(request):
+    report = loader.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+async def get_metrics(request):
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+
+metrics.registry.register_collector(
+    "suggest_cache", lambda: resources["cache"].stats() if resources and resources["cache"] else {})
+metrics.registry.register_collector(
+    "suggest_batching", lambda: resources["scheduler"].metrics() if resources and resources["scheduler"] else {})
+metrics.registry.register_collector(
+    "suggest_neighbours", lambda: resources["neighbours"].stats() if resources and resources["neighbours"] else {})
+
+
+async def page_not_found(request, exc):
+    return HTMLResponse("<h1>404</h1><p>The Resource You Requested Is Not Found.</p>", status_code=404)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    global loader, resources
+    # components load in background threads; requests are answered as soon as theirs are ready
+    loader = ResourceLoader(config).start()
+    resources = loader.resources
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, reload_in_background, resources, load_config)
+    except (RuntimeError, NotImplementedError) as e:
+        # only the main thread's loop on Unix can handle signals (not e.g. a test client's)
+        print(f"SIGUSR1 index reload not available: {e}")
+    yield
+    executor.shutdown(wait=False)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/v1/resources/mesh", get_mesh, methods=["GET"]),
+        Route("/api/v1/resources/mesh/stream", stream_mesh, methods=["GET"]),
+        Route("/api/v1/resources/mesh/bulk", bulk_mesh, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/ready", ready, methods=["GET"]),
+        Route("/metrics", get_metrics, methods=["GET"]),
+    ],
+    middleware=[Middleware(RequestMetrics)],
+    exception_handlers={404: page_not_found},
+    lifespan=lifespan,
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="MeSH Suggester ASGI server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port)
@@ -0,0 +1,133 @@
+"""
+Cross-request micro-batching in front of the query encoder.
+
+Every HTTP request / Gradio click submits its keywords to one shared BatchScheduler
+instead of calling DenseModel itself. A single worker thread collects pending keywords
+for up to `max_wait_ms` (or until `max_batch` keywords are waiting), encodes them with
+one forward pass and resolves each caller's future with its own rows of q_reps.
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from suggest_mesh_terms import encode_queries
+
+
+class BatchScheduler:
+    def __init__(self, model, tokenizer, max_wait_ms=5, max_batch=64):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch = max_batch
+
+        self._pending = deque()  # (queries, future, enqueue_time)
+        self._pending_items = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._batches = 0
+        self._items = 0
+        self._requests = 0
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, queries):
+        """Queue a non-empty list of keywords; the returned future resolves to their q_reps array."""
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchScheduler is closed")
+            self._pending.append((list(queries), future, time.monotonic()))
+            self._pending_items += len(queries)
+            self._max_queue_depth = max(self._max_queue_depth, self._pending_items)
+            self._cond.notify()
+        return future
+
+    def encode(self, queries):
+        """Blocking drop-in for `encode_queries(queries, model, tokenizer)`."""
+        return self.submit(queries).result()
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "queue_depth": self._pending_items,
+                "queue_requests": len(self._pending),
+                "max_queue_depth": self._max_queue_depth,
+                "batches": self._batches,
+                "requests": self._requests,
+                "items": self._items,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "mean_wait_ms": 1000.0 * self._total_wait / self._requests if self._requests else 0.0,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "max_batch": self.max_batch,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            # wait for more work until the oldest request has waited max_wait or the batch is full
+            deadline = self._pending[0][2] + self.max_wait
+            while self._pending_items < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = []
+            size = 0
+            # a request larger than max_batch is still encoded, just on its own
+            while self._pending and (not batch or size + len(self._pending[0][0]) <= self.max_batch):
+                entry = self._pending.popleft()
+                batch.append(entry)
+                size += len(entry[0])
+            self._pending_items -= size
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            started = time.monotonic()
+            queries = [query for entry in batch for query in entry[0]]
+            try:
+                q_reps = encode_queries(queries, self.model, self.tokenizer)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for entry_queries, future, enqueued in batch:
+                future.set_result(q_reps[start:start + len(entry_queries)])
+                start += len(entry_queries)
+            with self._cond:
+                self._batches += 1
+                self._requests += len(batch)
+                self._items += len(queries)
+                self._total_wait += sum(started - enqueued for _, _, enqueued in batch)
+
+
+def create_scheduler(model, tokenizer, config):
+    """Build the scheduler described by the `batching` section of config.json, or None when disabled."""
+    batching = config.get("batching", {})
+    if not batching.get("enabled", False):
+        return None
+    return BatchScheduler(
+        model,
+        tokenizer,
+        max_wait_ms=batching.get("max_wait_ms", 5),
+        max_batch=batching.get("max_batch", 64),
+    )
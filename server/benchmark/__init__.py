@@ -0,0 +1 @@
+# Offline benchmarks for the suggestion server; run from server/ as `python -m benchmark.<name>`.
@@ -0,0 +1,342 @@
+"""
+Load test for the HTTP API (main.py under waitress, prefork.py or asgi.py) and the
+Gradio app (app.py), replaying a query log.
+
+The log is JSONL with one request per line: `{"keywords": [...]}` (as in
+benchmark/queries.jsonl), `{"term": "a$b"}` (the API's own parameter) or `{"query":
+"boolean query"}`, each optionally with a `"type"`. It is replayed in a loop for as long
+as a level runs.
+
+    closed loop  --users 50 100 200 500: that many simulated users, each sending its next
+                 request as soon as the previous one is answered (plus --think_ms);
+                 latency is the time each request took
+    open loop    --rate 20 50 100: requests arrive at that many per second (Poisson, or
+                 evenly spaced with --uniform) whether or not earlier ones were answered;
+                 latency counts from the scheduled arrival, so queueing in the client is
+                 not hidden, and `dispatch_delay_ms` shows when the client itself fell behind
+
+Every level runs for --duration seconds and reports the latency distribution, status
+and error counts and throughput. Server-side saturation is reported from the server's
+/metrics (HTTP only): the server's own mean time per stage and per request during the
+level, so that `queueing_ms` (client latency minus server time) shows requests waiting
+for a free server thread, the requests it counted by status, and its micro-batching
+gauges. With --server_pid, the CPU use and RSS of the server process are sampled too.
+
+    python -m benchmark.loadtest http://127.0.0.1:5000 --users 50 100 200 500 --duration 60
+    python -m benchmark.loadtest http://127.0.0.1:7860 --gradio --rate 5 10 20 --type Atomic
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy
+import requests
+
+from query_parser import parse_boolean_query
+
+LOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries.jsonl")
+GRADIO_METHODS = {"Semantic": "Semantic-BERT", "Fragment": "Fragment-BERT", "Atomic": "Atomic-BERT", "ATM": "ATM"}
+METRIC_LINE = re.compile(r'^(\w+)(?:\{(.*)\})?\s+(\S+)$')
+
+
+def read_log(path, type):
+    entries = []
+    with open(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            keywords = item.get("keywords") or item.get("Keywords")
+            if keywords is None and item.get("term"):
+                keywords = item["term"].split("$")
+            if keywords is None and item.get("query"):
+                keywords = [keyword for group in parse_boolean_query(item["query"]) for keyword in group]
+            if not keywords:
+                continue
+            query = item.get("query") or " OR ".join(f'"{keyword}"' for keyword in keywords)
+            entries.append({"keywords": keywords, "query": query, "type": item.get("type") or type})
+    return entries
+
+
+class HttpTarget:
+    def __init__(self, url, fusion=None, timeout=60):
+        self.url = url.rstrip("/")
+        self.fusion = fusion
+        self.timeout = timeout
+
+    def send(self, session, entry):
+        url = f"{self.url}/api/v1/resources/mesh?term={quote('$'.join(entry['keywords']))}&type={entry['type']}"
+        if self.fusion:
+            url += f"&fusion={self.fusion}"
+        return session.get(url, timeout=self.timeout).status_code
+
+    def metrics(self):
+        try:
+            response = requests.get(self.url + "/metrics", timeout=10)
+        except requests.RequestException:
+            return None
+        return parse_metrics(response.text) if response.status_code == 200 else None
+
+
+class GradioTarget:
+    """The `/suggest` API of app.py: one POST to enqueue, then the event stream until completion."""
+
+    def __init__(self, url, api_prefix="/gradio_api", timeout=60):
+        self.url = url.rstrip("/") + api_prefix + "/call/suggest"
+        self.timeout = timeout
+
+    def send(self, session, entry):
+        method = GRADIO_METHODS.get(entry["type"], entry["type"])
+        response = session.post(self.url, json={"data": [entry["query"], method]}, timeout=self.timeout)
+        if response.status_code != 200:
+            return response.status_code
+        event_id = response.json()["event_id"]
+        event = None
+        with session.get(f"{self.url}/{event_id}", stream=True, timeout=self.timeout) as stream:
+            for line in stream.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                    if event in ("complete", "error"):
+                        break
+        # Gradio answers 200 either way; an error event is reported as a 500
+        return 200 if event == "complete" else 500
+
+    def metrics(self):
+        return None
+
+
+def parse_metrics(text):
+    """{(name, labels): value} of a Prometheus text page."""
+    values = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            name, labels, value = match.groups()
+            values[(name, labels or "")] = float(value)
+    return values
+
+
+def server_report(before, after, requests_sent):
+    if before is None or after is None:
+        return None
+    stages = {}
+    for (name, labels), total in after.items():
+        if name != "suggest_stage_seconds_sum":
+            continue
+        count_key = ("suggest_stage_seconds_count", labels)
+        count = after.get(count_key, 0) - before.get(count_key, 0)
+        if count > 0:
+            stage = labels.split('"')[1]
+            stages[stage] = {"count": count, "mean_ms": (total - before.get((name, labels), 0)) * 1000 / count}
+    statuses = {}
+    for (name, labels), total in after.items():
+        if name == "suggest_requests_total":
+            delta = total - before.get((name, labels), 0)
+            if delta:
+                statuses[labels] = delta
+    gauges = {name: value for (name, labels), value in after.items() if name.startswith("suggest_batching_")}
+    return {"stages": stages, "requests": statuses, "batching": gauges, "requests_sent": requests_sent}
+
+
+def process_sample(pid):
+    """Cumulative CPU seconds and RSS (MB) of a local process, from /proc."""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / ticks
+    rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    return cpu, rss
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.outcomes = []  # (scheduled, started, finished, status, error)
+        self.in_flight = 0
+
+    def record(self, target, session, entry, scheduled):
+        with self.lock:
+            self.in_flight += 1
+        started = time.perf_counter()
+        status, error = None, None
+        try:
+            status = target.send(session, entry)
+        except Exception as e:
+            error = type(e).__name__
+        finished = time.perf_counter()
+        with self.lock:
+            self.in_flight -= 1
+            self.outcomes.append((scheduled, started, finished, status, error))
+
+
+def closed_loop(target, entries, users, duration, think_ms, recorder):
+    deadline = time.perf_counter() + duration
+    cycle = itertools.cycle(entries)
+    cycle_lock = threading.Lock()
+
+    def user():
+        session = requests.Session()
+        while time.perf_counter() < deadline:
+            with cycle_lock:
+                entry = next(cycle)
+            recorder.record(target, session, entry, time.perf_counter())
+            if think_ms:
+                time.sleep(think_ms / 1000)
+
+    threads = [threading.Thread(target=user, daemon=True) for _ in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def open_loop(target, entries, rate, duration, uniform, max_in_flight, recorder, seed=0):
+    rng = random.Random(seed)
+    local = threading.local()
+
+    def send(entry, scheduled):
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        recorder.record(target, local.session, entry, scheduled)
+
+    start = time.perf_counter()
+    arrival = start
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        for entry in itertools.cycle(entries):
+            arrival += 1 / rate if uniform else rng.expovariate(rate)
+            if arrival >= start + duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(send, entry, arrival)
+
+
+def sample(recorder, pid, interval, stop, timeline):
+    start = time.perf_counter()
+    previous = (start, process_sample(pid)[0] if pid else None, 0)
+    while not stop.wait(interval):
+        now = time.perf_counter()
+        with recorder.lock:
+            in_flight, completed = recorder.in_flight, len(recorder.outcomes)
+        point = {"t": now - start, "in_flight": in_flight,
+                 "completed_per_second": (completed - previous[2]) / (now - previous[0])}
+        cpu = None
+        if pid:
+            cpu, rss = process_sample(pid)
+            point.update({"server_cpu_percent": (cpu - previous[1]) * 100 / (now - previous[0]), "server_rss_mb": rss})
+        timeline.append(point)
+        previous = (now, cpu, completed)
+
+
+def summarize(outcomes, wall, open_loop):
+    latencies = numpy.array([finished - scheduled for scheduled, _, finished, _, _ in outcomes]) * 1000
+    statuses, errors = {}, {}
+    for _, _, _, status, error in outcomes:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+        else:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = statuses.get("200", 0)
+    summary = {
+        "requests": len(outcomes),
+        "ok": ok,
+        "error_rate": 1 - ok / len(outcomes) if outcomes else None,
+        "statuses": statuses,
+        "errors": errors,
+        "throughput": ok / wall,
+    }
+    if len(latencies):
+        p50, p90, p95, p99 = numpy.percentile(latencies, [50, 90, 95, 99])
+        summary.update({"p50_ms": float(p50), "p90_ms": float(p90), "p95_ms": float(p95), "p99_ms": float(p99),
+                        "max_ms": float(latencies.max()), "mean_ms": float(latencies.mean())})
+    if open_loop and outcomes:
+        delays = numpy.array([started - scheduled for scheduled, started, _, _, _ in outcomes]) * 1000
+        summary["dispatch_delay_ms"] = {"p50": float(numpy.percentile(delays, 50)),
+                                        "p99": float(numpy.percentile(delays, 99))}
+    return summary
+
+
+def run_level(target, entries, args, users=None, rate=None):
+    recorder = Recorder()
+    timeline, stop = [], threading.Event()
+    sampler = threading.Thread(target=sample, args=(recorder, args.server_pid, args.sample_interval, stop, timeline),
+                               daemon=True)
+    before = target.metrics()
+    sampler.start()
+    start = time.perf_counter()
+    if users is not None:
+        closed_loop(target, entries, users, args.duration, args.think_ms, recorder)
+    else:
+        open_loop(target, entries, rate, args.duration, args.uniform, args.max_in_flight, recorder, args.seed)
+    wall = time.perf_counter() - start
+    stop.set()
+    sampler.join()
+
+    level = {"users": users} if users is not None else {"rate": rate}
+    level.update(summarize(recorder.outcomes, wall, users is None))
+    server = server_report(before, target.metrics(), len(recorder.outcomes))
+    if server is not None:
+        level["server"] = server
+        request_stage = server["stages"].get("request")
+        if request_stage and "mean_ms" in level:
+            level["queueing_ms"] = level["mean_ms"] - request_stage["mean_ms"]
+    level["timeline"] = timeline
+    return level
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the suggestion API or the Gradio app")
+    parser.add_argument("url", help="e.g. http://127.0.0.1:5000 (API) or http://127.0.0.1:7860 (Gradio)")
+    parser.add_argument("--log", default=LOG_PATH, help="JSONL query log to replay")
+    parser.add_argument("--type", default="Fragment", help="suggestion type of log lines without one")
+    parser.add_argument("--fusion", help="fusion method for BERT types (HTTP only)")
+    parser.add_argument("--gradio", action="store_true", help="call the /suggest API of app.py")
+    parser.add_argument("--gradio_api", default="/gradio_api", help="Gradio API prefix ('' before Gradio 5)")
+    load = parser.add_mutually_exclusive_group(required=True)
+    load.add_argument("--users", type=int, nargs="+", help="closed loop: concurrent users per level")
+    load.add_argument("--rate", type=float, nargs="+", help="open loop: requests per second per level")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per level")
+    parser.add_argument("--think_ms", type=float, default=0, help="closed loop: pause between a user's requests")
+    parser.add_argument("--uniform", action="store_true", help="open loop: evenly spaced instead of Poisson")
+    parser.add_argument("--max_in_flight", type=int, default=1000, help="open loop: client connection limit")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--server_pid", type=int, help="sample the CPU and RSS of this (local) server process")
+    parser.add_argument("--sample_interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    args = parser.parse_args()
+
+    entries = read_log(args.log, args.type)
+    if args.gradio:
+        target = GradioTarget(args.url, args.gradio_api, args.timeout)
+    else:
+        target = HttpTarget(args.url, args.fusion, args.timeout)
+    levels = []
+    for value in args.users or args.rate:
+        level = run_level(target, entries, args, **({"users": value} if args.users else {"rate": value}))
+        print(f"{'users' if args.users else 'rate'} {value:<6} {level['throughput']:8.1f} ok/s  "
+              f"p50 {level.get('p50_ms', 0):8.1f} ms  p99 {level.get('p99_ms', 0):8.1f} ms  "
+              f"errors {level['error_rate'] or 0:.1%}"
+              + (f"  queueing {level['queueing_ms']:.1f} ms" if "queueing_ms" in level else ""))
+        levels.append(level)
+
+    report = {
+        "meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "url": args.url, "log": args.log,
+                 "target": "gradio" if args.gradio else "http", "mode": "closed" if args.users else "open",
+                 "duration": args.duration, "type": args.type, "fusion": args.fusion},
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
@@ -0,0 +1,226 @@
+"""
+End-to-end benchmark of every suggestion method over a fixed corpus of systematic-review
+queries (benchmark/queries.jsonl, one `{"id", "title", "keywords"}` per line).
+
+For each method and concurrency level, every query is suggested `--repeat` times through
+`create_engine(...).suggest()` from a pool of that many threads, exactly as the servers
+call the engines. Reported, as JSON:
+
+    startup     import time of the suggestion modules, wall time until every resource
+                is loaded, and the load time of each component
+    results     per method and concurrency: p50/p95/p99/mean latency per query,
+                throughput (queries and keywords per second), errors, and the mean time
+                per query of each instrumented stage (see metrics.py)
+    peak_rss_mb peak resident memory of the process
+
+Run it from server/ against the real models, or offline against a synthetic workspace
+(built on first use with --build, see benchmark/synthetic.py); ATM and UMLS then talk to
+the local stubs of benchmark/stubs.py, which are started whenever config.json points at
+127.0.0.1. MetaMap needs the MetaMap binaries and is not benchmarked.
+
+    python -m benchmark.run --workspace /tmp/mesh-bench --build --output results.json
+    python -m benchmark.run --workspace /tmp/mesh-bench --baseline results.json
+
+With --baseline, the latencies and throughput are also compared with an earlier output.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy
+
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queries.jsonl")
+METHODS = ('Atomic', 'Semantic', 'Fragment', 'ATM', 'UMLS')
+LOCAL_HOSTS = ('127.0.0.1', 'localhost')
+
+
+def load_queries(path=QUERIES_PATH):
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def start_local_stubs(config, latency_ms):
+    """Start the stubs on the port of the ATM/UMLS URLs if config.json points them at this host."""
+    from benchmark.stubs import start_stubs
+
+    ports = {urlparse(config[key]).port or 80 for key in ('url', 'umls_url')
+             if urlparse(config.get(key, "")).hostname in LOCAL_HOSTS}
+    return [start_stubs(port=port, latency_ms=latency_ms) for port in sorted(ports)]
+
+
+def load(config):
+    # only a cold import says anything (building a workspace already imports torch)
+    cold = "torch" not in sys.modules
+    start = time.perf_counter()
+    import resources
+    import_seconds = time.perf_counter() - start if cold else None
+
+    start = time.perf_counter()
+    loader = resources.ResourceLoader(config).start()
+    try:
+        loader.wait()
+    finally:
+        loader.shutdown()
+    startup = {
+        "import_seconds": import_seconds,
+        "load_seconds": time.perf_counter() - start,
+        "components": {name: status.get("seconds") for name, status in loader.status.items()},
+        "rss_mb": peak_rss_mb(),
+    }
+    return loader.resources, startup
+
+
+def stage_totals():
+    from metrics import registry
+
+    return {stage: histogram.sum for stage, histogram in list(registry.stages.items())}
+
+
+def run_level(resources, method, queries, concurrency, repeat):
+    from resources import create_engine
+
+    def suggest(keywords):
+        start = time.perf_counter()
+        try:
+            create_engine(resources, {"Keywords": keywords, "Type": method}).suggest()
+        except Exception as e:
+            return time.perf_counter() - start, str(e)
+        return time.perf_counter() - start, None
+
+    work = [query["keywords"] for query in queries] * repeat
+    stages_before = stage_totals()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        outcomes = list(executor.map(suggest, work))
+    wall = time.perf_counter() - start
+    stages = {stage: (total - stages_before.get(stage, 0.0)) * 1000 / len(work)
+              for stage, total in stage_totals().items() if total > stages_before.get(stage, 0.0)}
+
+    latencies = numpy.array([seconds for seconds, _ in outcomes]) * 1000
+    errors = [error for _, error in outcomes if error is not None]
+    p50, p95, p99 = numpy.percentile(latencies, [50, 95, 99])
+    return {
+        "method": method,
+        "concurrency": concurrency,
+        "queries": len(work),
+        "keywords": sum(len(keywords) for keywords in work),
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(latencies.mean()),
+        "queries_per_second": len(work) / wall,
+        "keywords_per_second": sum(len(keywords) for keywords in work) / wall,
+        "stages_ms": stages,
+    }
+
+
+def run(resources, methods, queries, concurrency_levels, repeat, warmup=3):
+    results = []
+    for method in methods:
+        # first calls pay for lazy initialisation (HTTP sessions, allocator growth, ...)
+        run_level(resources, method, queries[:warmup], 1, 1)
+        for concurrency in concurrency_levels:
+            result = run_level(resources, method, queries, concurrency, repeat)
+            print(f"{method:9} x{concurrency:<3} p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+                  f"p99 {result['p99_ms']:8.1f} ms  {result['queries_per_second']:8.1f} q/s  "
+                  f"errors {result['errors']}")
+            results.append(result)
+    return results
+
+
+def compare(results, baseline):
+    """Relative change of each result against the baseline run with the same method and concurrency."""
+    previous = {(result["method"], result["concurrency"]): result for result in baseline.get("results", [])}
+    changes = []
+    for result in results:
+        before = previous.get((result["method"], result["concurrency"]))
+        if before is None:
+            continue
+        change = {"method": result["method"], "concurrency": result["concurrency"]}
+        for key in ("p50_ms", "p95_ms", "p99_ms", "queries_per_second"):
+            change[key] = (result[key] - before[key]) / before[key] if before[key] else None
+        changes.append(change)
+    return changes
+
+
+def meta(args):
+    import faiss
+    import torch
+    import transformers
+
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "workspace": os.getcwd(),
+        "queries_path": args.queries,
+        "repeat": args.repeat,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "transformers": transformers.__version__,
+        "faiss": faiss.__version__,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every suggestion method")
+    parser.add_argument("--workspace", help="directory with config.json, Model/ and data/ (default: current)")
+    parser.add_argument("--build", action="store_true", help="build a synthetic workspace if it does not exist")
+    parser.add_argument("--queries", default=QUERIES_PATH)
+    parser.add_argument("--methods", nargs="+", choices=METHODS, default=list(METHODS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3, help="passes over the query corpus per level")
+    parser.add_argument("--stub_latency_ms", type=float, default=0, help="simulated round trip of the stubs")
+    parser.add_argument("--output", help="write the JSON report here (default: stdout)")
+    parser.add_argument("--baseline", help="earlier JSON report to compare with")
+    args = parser.parse_args()
+
+    args.queries = os.path.abspath(args.queries)
+    if args.workspace:
+        if args.build and not os.path.exists(os.path.join(args.workspace, "config.json")):
+            from benchmark.synthetic import build_workspace
+            build_workspace(args.workspace, queries_path=args.queries)
+        os.chdir(args.workspace)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+
+    from suggest_engine import load_config
+
+    config = load_config()
+    stubs = start_local_stubs(config, args.stub_latency_ms)
+    resources, startup = load(config)
+    results = run(resources, args.methods, load_queries(args.queries), args.concurrency, args.repeat)
+    for stub in stubs:
+        stub.shutdown()
+
+    report = {"meta": meta(args), "startup": startup, "results": results, "peak_rss_mb": peak_rss_mb()}
+    if baseline is not None:
+        report["baseline"] = {"meta": baseline.get("meta"), "changes": compare(results, baseline)}
+        for change in report["baseline"]["changes"]:
+            print(f"{change['method']:9} x{change['concurrency']:<3} vs baseline: "
+                  + "  ".join(f"{key} {value:+.1%}" for key, value in change.items()
+                              if key not in ("method", "concurrency") and value is not None))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
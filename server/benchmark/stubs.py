@@ -0,0 +1,83 @@
+"""
+Local stand-ins for the remote services behind ATM and UMLS suggestions.
+
+`/esearch.fcgi` answers like E-utilities esearch with a translation set that maps the
+term to itself as a MeSH term, and `/umls/_search` answers like the UMLS Elasticsearch
+index with one MSH thesaurus entry per query (also for `cui:` lookups). `latency_ms`
+adds a fixed delay per response to model the network round trip.
+
+    python -m benchmark.stubs --port 8765 --latency_ms 50
+"""
+
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+def esearch_response(term):
+    return {"esearchresult": {"translationset": [
+        {"from": term, "to": f'"{term}"[MeSH Terms] OR "{term}"[All Fields]'}
+    ]}}
+
+
+def umls_response(term):
+    return {"hits": {"hits": [
+        {"_source": {"thesaurus": [{"MRCONSO_STR": term.title(), "MRCONSO_SAB": "MSH"}]}}
+    ]}}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in two writes: with Nagle on, a keep-alive client's delayed
+    # ACK holds the body back ~40 ms per response
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/esearch"):
+            body = esearch_response(query.get("term", [""])[0])
+        elif url.path.startswith("/umls"):
+            body = umls_response(query.get("q", [""])[0])
+        else:
+            self.send_error(404)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+        content = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stubs(host="127.0.0.1", port=8765, latency_ms=0):
+    """Serve the stubs from a daemon thread; call .shutdown() on the result to stop."""
+    handler = type("Handler", (StubHandler,), {"latency": latency_ms / 1000})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local ATM and UMLS stubs for the benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency_ms", type=float, default=0)
+    args = parser.parse_args()
+
+    server = start_stubs(args.host, args.port, args.latency_ms)
+    print(f"Stubs serving on {args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,134 @@
+"""
+A tiny synthetic workspace for running the benchmarks offline.
+
+It mirrors the layout the server expects under server/ (Model/checkpoint-80000,
+data/mesh2.json, data/Encoding, the word2vec store and config.json) with a two-layer
+BERT encoder, a word-level tokenizer built from the benchmark queries, MeSH-like
+headings made of the query vocabulary, their encodings, and word vectors in which the
+words of one query lie close together, so that Semantic grouping has something to group.
+Nothing is downloaded; the same seed always builds the same workspace.
+
+config.json is the server's own with the ATM and UMLS URLs pointed at the local stubs
+of benchmark/stubs.py, the local ATM index and the suggestion cache disabled (so every
+request reaches the stubs and the encoder), and `encoder.tokenizer` set to the local
+tokenizer.
+
+    python -m benchmark.synthetic /tmp/mesh-bench --terms 5000
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+
+import numpy
+import torch
+from gensim.models import KeyedVectors
+from gensim.utils import tokenize
+from transformers import AutoConfig, BertConfig, BertModel, BertTokenizerFast
+
+from benchmark.run import QUERIES_PATH, load_queries
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SPECIAL_TOKENS = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+
+
+def build_tokenizer(path, words):
+    characters = [chr(c) for c in range(ord("a"), ord("z") + 1)] + [str(d) for d in range(10)]
+    vocab = SPECIAL_TOKENS + list("-,'()") + characters + sorted(words) + ["##" + c for c in characters]
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "vocab.txt"), "w") as f:
+        f.write("\n".join(dict.fromkeys(vocab)) + "\n")
+    tokenizer = BertTokenizerFast(os.path.join(path, "vocab.txt"))
+    tokenizer.save_pretrained(path)
+    return tokenizer
+
+
+def build_checkpoint(path, vocab_size, seed):
+    # at BERT's default init (0.02) every [CLS] vector points the same way (mean pairwise cosine
+    # ~0.9999), so rankings are near-ties; 0.3 spreads them like a trained encoder (~0.8)
+    config = BertConfig(vocab_size=vocab_size, hidden_size=64, num_hidden_layers=2, num_attention_heads=4,
+                        intermediate_size=128, max_position_embeddings=64, initializer_range=0.3)
+    torch.manual_seed(seed)
+    BertModel(config).save_pretrained(path)
+
+
+def build_mesh_dict(path, queries, terms, rng):
+    headings = list(dict.fromkeys(keyword.title() for query in queries for keyword in query["keywords"]))
+    words = sorted({word for heading in headings for word in heading.split()})
+    while len(headings) < terms:
+        headings.append(" ".join(rng.sample(words, rng.randint(1, 3))))
+    mesh_dict = [{"uid": f"D{i + 1:06d}", "term": heading} for i, heading in enumerate(headings[:terms])]
+    with open(path, "w") as f:
+        json.dump(mesh_dict, f)
+    return mesh_dict
+
+
+def build_encodings(workspace, mesh_dict, tokenizer):
+    from encoder_backend import load_encoder
+    from suggest_mesh_terms import encode_queries
+    from tevatron.faiss_retriever.__main__ import save_lookup
+
+    checkpoint = os.path.join(workspace, "Model/checkpoint-80000/")
+    model = load_encoder(checkpoint, AutoConfig.from_pretrained(checkpoint, num_labels=1))
+    terms = [item["term"] for item in mesh_dict]
+    reps = numpy.vstack([encode_queries(terms[i:i + 256], model, tokenizer) for i in range(0, len(terms), 256)])
+    os.makedirs(os.path.join(workspace, "data/Encoding"), exist_ok=True)
+    numpy.save(os.path.join(workspace, "data/Encoding/passage_reps.npy"), reps.astype(numpy.float32))
+    save_lookup(os.path.join(workspace, "data/Encoding/passage_lookup.npy"), [item["uid"] for item in mesh_dict])
+
+
+def build_word2vec(path, queries, seed, size=50):
+    # every word starts near the topic vector of the first query it appears in
+    rng = numpy.random.default_rng(seed)
+    vectors = {}
+    for query in queries:
+        topic = rng.normal(size=size)
+        for keyword in query["keywords"]:
+            for token in tokenize(keyword.lower()):
+                if token not in vectors:
+                    vectors[token] = topic + rng.normal(scale=0.1, size=size)
+    model_w2v = KeyedVectors(vector_size=size)
+    model_w2v.add_vectors(list(vectors), numpy.asarray(list(vectors.values()), dtype=numpy.float32))
+    model_w2v.save(path)
+
+
+def build_config(path, stub_port):
+    with open(os.path.join(SERVER_DIR, "config.json"), "r") as f:
+        config = json.load(f)
+    stub = f"http://127.0.0.1:{stub_port}"
+    config.update({"url": stub + "/esearch.fcgi", "umls_url": stub + "/umls/_search?pretty=true&q="})
+    config["atm"] = {**config.get("atm", {}), "local_index": ""}
+    config["http"] = {**config.get("http", {}), "ncbi_rate_per_second": 1000, "umls_rate_per_second": None}
+    config["encoder"] = {**config.get("encoder", {}), "tokenizer": "Model/tokenizer"}
+    config["index"] = {**config.get("index", {}), "type": "flat"}
+    config["cache"] = {**config.get("cache", {}), "enabled": False}
+    config["word2vec"] = {"path": "Model/PubMed-w2v.kv", "binary": "Model/PubMed-w2v.bin"}
+    with open(path, "w") as f:
+        json.dump(config, f, indent=2)
+
+
+def build_workspace(workspace, terms=5000, seed=0, stub_port=8765, queries_path=QUERIES_PATH):
+    queries = load_queries(queries_path)
+    os.makedirs(os.path.join(workspace, "data"), exist_ok=True)
+    words = {word for query in queries for keyword in query["keywords"]
+             for word in re.findall(r"[a-z0-9]+", keyword.lower())}
+    tokenizer = build_tokenizer(os.path.join(workspace, "Model/tokenizer"), words)
+    build_checkpoint(os.path.join(workspace, "Model/checkpoint-80000"), len(tokenizer), seed)
+    mesh_dict = build_mesh_dict(os.path.join(workspace, "data/mesh2.json"), queries, terms, random.Random(seed))
+    build_encodings(workspace, mesh_dict, tokenizer)
+    build_word2vec(os.path.join(workspace, "Model/PubMed-w2v.kv"), queries, seed)
+    build_config(os.path.join(workspace, "config.json"), stub_port)
+    return workspace
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build a tiny offline workspace for the benchmarks")
+    parser.add_argument("workspace")
+    parser.add_argument("--terms", type=int, default=5000, help="number of synthetic MeSH headings")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub_port", type=int, default=8765, help="port of the ATM/UMLS stubs")
+    args = parser.parse_args()
+
+    print(build_workspace(args.workspace, args.terms, args.seed, args.stub_port))
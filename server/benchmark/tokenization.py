@@ -0,0 +1,76 @@
+"""
+CPU time per keyword of the query encoder with fixed 32-token padding (the previous
+tokenizer path) versus `encode_queries` (dynamic padding with length bucketing), and the
+largest difference between the two sets of CLS embeddings.
+
+    python -m benchmark.tokenization --keywords 2000 --batch_size 1 64 256
+"""
+
+import argparse
+import json
+import random
+import time
+
+import numpy
+from transformers import AutoConfig
+
+from encoder_backend import load_encoder
+from suggest_engine import load_config
+from suggest_mesh_terms import encode_queries, load_tokenizer
+
+
+def encode_queries_fixed(queries, model, tokenizer):
+    queries = [query.lower() for query in queries]
+    query_tokenised = tokenizer(
+        queries,
+        add_special_tokens=True,
+        max_length=32,
+        truncation=True,
+        padding='max_length',
+        return_token_type_ids=False,
+        return_attention_mask=True,
+        return_tensors='pt'
+    )
+    encoded = model(query_tokenised)
+    return encoded.q_reps.detach().numpy()
+
+
+def cpu_seconds(encode, keywords, batch_size, model, tokenizer):
+    encode(keywords[:batch_size], model, tokenizer)  # warm-up
+    start = time.process_time()
+    reps = [encode(keywords[i:i + batch_size], model, tokenizer) for i in range(0, len(keywords), batch_size)]
+    return time.process_time() - start, numpy.vstack(reps)
+
+
+def run(keywords, batch_sizes, model, tokenizer):
+    results = []
+    for batch_size in batch_sizes:
+        fixed_seconds, fixed_reps = cpu_seconds(encode_queries_fixed, keywords, batch_size, model, tokenizer)
+        dynamic_seconds, dynamic_reps = cpu_seconds(encode_queries, keywords, batch_size, model, tokenizer)
+        results.append({
+            "batch_size": batch_size,
+            "fixed_ms_per_keyword": fixed_seconds * 1000 / len(keywords),
+            "dynamic_ms_per_keyword": dynamic_seconds * 1000 / len(keywords),
+            "speedup": fixed_seconds / dynamic_seconds if dynamic_seconds else None,
+            "max_abs_diff": float(numpy.abs(fixed_reps - dynamic_reps).max()),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fixed vs dynamic padding in the query encoder")
+    parser.add_argument("--keywords", type=int, default=2000, help="number of MeSH terms to encode")
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[1, 64, 256])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = load_config()
+    checkpoint = "Model/checkpoint-80000/"
+    model = load_encoder(checkpoint, AutoConfig.from_pretrained(checkpoint, num_labels=1, cache_dir="cache/"),
+                         config.get('encoder', {}))
+    tokenizer = load_tokenizer(config)
+    with open("data/mesh2.json", "r") as f:
+        terms = [item["term"] for item in json.load(f)]
+    random.Random(args.seed).shuffle(terms)
+    for result in run(terms[:args.keywords], args.batch_size, model, tokenizer):
+        print(json.dumps(result))
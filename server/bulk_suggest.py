@@ -0,0 +1,180 @@
+"""
+Bulk MeSH suggestions for whole sets of boolean queries.
+
+Input is JSONL, one query per line: either a JSON string or an object with a `query`
+field (and optionally an `id`, defaulting to the line number). Each query is split into
+AND-groups of OR-terms by `query_parser.parse_boolean_query`, and every group gets the
+same suggestions `GET /api/v1/resources/mesh?term=...&type=...` would give it.
+
+Queries are processed in chunks: the keywords of a chunk are deduplicated across all of
+its queries, encoded in large batches and sent to FAISS in a single search, and the
+per-group results are assembled from those shared rankings. One JSON line is produced
+per query, in input order.
+
+    python bulk_suggest.py queries.jsonl -o suggestions.jsonl --type Fragment
+"""
+
+import argparse
+import json
+import sys
+import time
+from itertools import chain
+
+import numpy
+
+from metrics import timed
+from query_parser import parse_boolean_query
+from suggest_engine import load_config
+from suggest_mesh_terms import (FUSION_METHODS, encode_queries, fuse_results, fusion_settings, get_mesh_terms,
+                                seperate_keywords_group)
+
+BULK_TYPES = ('Semantic', 'Atomic', 'Fragment')
+
+
+def read_queries(lines):
+    """
+    Yield one {"id", "query", ...} entry per non-blank JSONL line; raises ValueError,
+    naming the (1-based) line, for a line that is not a query string or an object with one.
+    """
+    for line_number, line in enumerate(lines):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number + 1}: invalid JSON: {e}")
+        if isinstance(entry, str):
+            entry = {"query": entry}
+        if not isinstance(entry, dict):
+            raise ValueError(f"Line {line_number + 1}: expected a query string or an object with a \"query\" field")
+        if not isinstance(entry.get("query"), str):
+            raise ValueError(f"Line {line_number + 1}: \"query\" must be a string")
+        entry.setdefault("id", line_number)
+        yield entry
+
+
+def bulk_suggest(entries, resources, type="Fragment", fusion=None, batch_size=256, chunk_size=1000, stats=None):
+    """Yield one {"id", "query", "Splits", "Data"} result per query entry, in order."""
+    if type not in BULK_TYPES:
+        raise ValueError(f"Type not valid for bulk suggestion: {type}")
+    settings = fusion_settings(load_config(), fusion)
+    chunk = []
+    for entry in entries:
+        chunk.append(entry)
+        if len(chunk) >= chunk_size:
+            yield from _suggest_chunk(chunk, resources, type, settings, batch_size, stats)
+            chunk = []
+    if chunk:
+        yield from _suggest_chunk(chunk, resources, type, settings, batch_size, stats)
+
+
+def _suggest_chunk(chunk, resources, type, settings, batch_size, stats):
+    depth = settings["depth"]
+    all_groups = [parse_boolean_query(entry["query"]) for entry in chunk]
+    if type == "Semantic":
+        # a single-keyword group is answered as Atomic and never split
+        all_splits = [[seperate_keywords_group(group, resources["model_w2v"]) if len(group) > 1 else [group]
+                       for group in groups] for groups in all_groups]
+    else:
+        all_splits = [[[group] for group in groups] for groups in all_groups]
+
+    # the encoder lowercases its input, so keywords differing only in case share one row
+    keywords = list(dict.fromkeys(keyword.lower()
+                                  for keyword in chain.from_iterable(chain.from_iterable(all_groups))))
+    rows = {keyword: row for row, keyword in enumerate(keywords)}
+    if keywords:
+        q_reps = _encode(keywords, resources, batch_size)
+        with timed("search"):
+            all_scores, all_indices = resources["retriever"].search(q_reps, max(settings["candidates"], depth))
+    if stats is not None:
+        stats["queries"] = stats.get("queries", 0) + len(chunk)
+        stats["keywords"] = stats.get("keywords", 0) + len(keywords)
+
+    look_up = resources["look_up"]
+    mesh_dict = resources["mesh_dict"]
+
+    def top_uids(keyword):
+        indices = all_indices[rows[keyword.lower()]]
+        return look_up[indices[indices >= 0][:depth]].astype(str).tolist()
+
+    for entry, groups, splits in zip(chunk, all_groups, all_splits):
+        data = []
+        for group, subgroups in zip(groups, splits):
+            if len(group) == 1 or type == "Atomic":
+                group_type = "Atomic"
+                results = [([keyword], top_uids(keyword)) for keyword in group]
+            else:
+                group_type = type
+                results = []
+                for keywords in subgroups:
+                    if len(keywords) == 1:
+                        results.append((keywords, top_uids(keywords[0])))
+                    else:
+                        group_rows = [rows[keyword.lower()] for keyword in keywords]
+                        results.append((keywords, fuse_results(all_scores[group_rows], all_indices[group_rows],
+                                                               look_up, depth, settings["method"],
+                                                               settings["rrf_k"])))
+            for keywords, uids in results:
+                data.append({
+                    "Keywords": keywords,
+                    "type": group_type,
+                    "MeSH_Terms": get_mesh_terms(uids, mesh_dict)
+                })
+        yield {
+            "id": entry["id"],
+            "query": entry["query"],
+            "Splits": groups,
+            "Data": data
+        }
+
+
+def _encode(keywords, resources, batch_size):
+    cache = resources.get("cache")
+    vectors = [cache.get_vector(keyword) for keyword in keywords] if cache is not None else [None] * len(keywords)
+    missing = [i for i, q_rep in enumerate(vectors) if q_rep is None]
+    for start in range(0, len(missing), batch_size):
+        batch = missing[start:start + batch_size]
+        batch_keywords = [keywords[i] for i in batch]
+        q_reps = encode_queries(batch_keywords, resources["model"], resources["tokenizer"])
+        for i, q_rep in zip(batch, q_reps):
+            vectors[i] = q_rep
+        if cache is not None:
+            cache.put_vectors(batch_keywords, q_reps)
+    return numpy.vstack(vectors).astype(numpy.float32)
+
+
+if __name__ == '__main__':
+    from resources import load_resources
+
+    parser = argparse.ArgumentParser(description="Suggest MeSH terms for a JSONL file of boolean queries")
+    parser.add_argument("queries", help="JSONL file, one query string or {\"id\", \"query\"} object per line")
+    parser.add_argument("-o", "--output", help="JSONL output file (default: stdout)")
+    parser.add_argument("--type", default="Fragment", choices=BULK_TYPES)
+    parser.add_argument("--fusion", choices=FUSION_METHODS, help="default: fusion.method of config.json")
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--chunk_size", type=int, default=1000)
+    args = parser.parse_args()
+
+    # validate the whole file before writing any output
+    with open(args.queries, "r") as f:
+        try:
+            entries = list(read_queries(f))
+        except ValueError as e:
+            parser.error(f"{args.queries}: {e}")
+
+    resources = load_resources()
+    stats = {}
+    start = time.perf_counter()
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for result in bulk_suggest(entries, resources, args.type, args.fusion,
+                                   args.batch_size, args.chunk_size, stats):
+            out.write(json.dumps(result) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - start
+    keywords = stats.get("keywords", 0)
+    print(f"{stats.get('queries', 0)} queries, {keywords} distinct keywords in {elapsed:.2f}s "
+          f"({keywords / elapsed if elapsed else 0:.0f} keywords/s)", file=sys.stderr)
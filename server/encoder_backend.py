@@ -0,0 +1,153 @@
+"""
+Query encoder backends, selected by the `encoder` section of config.json.
+
+    torch       the fine-tuned checkpoint in full precision (default)
+    torch-int8  the same model with dynamically int8-quantized linear layers
+    onnx        the checkpoint exported to ONNX, run by ONNX Runtime
+    onnx-int8   the ONNX export with dynamically int8-quantized weights
+
+Whatever the backend, the encoder runs under torch.inference_mode() in an
+`InferenceModel`. `threads` and `inter_op_threads` pin torch's (and ONNX Runtime's)
+thread pools per server process; leave them null to keep the library defaults. A PyTorch
+backend can also be traced (`"compile": "jit"`) or compiled (`"compile": "compile"`).
+
+The ONNX files are exported (and quantized) on first use if they are missing, or
+ahead of time with `python encoder_backend.py export`. Before switching a node to a
+faster backend, compare it with the PyTorch path:
+
+    python encoder_backend.py parity --backend onnx-int8
+
+reports the cosine similarity of the query vectors, the top-10 MeSH overlap on a fixed
+keyword set and the per-keyword latency of both backends, and exits non-zero when the
+backend falls below --min_cosine / --min_overlap.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy
+
+from tevatron.modeling.dense import DenseModel
+from tevatron.modeling.onnx_dense import OnnxDenseModel, export_onnx, quantize_dense, quantize_onnx
+from tevatron.modeling.runtime import InferenceModel, configure_threads
+
+ENCODER_BACKENDS = ('torch', 'torch-int8', 'onnx', 'onnx-int8')
+# a backend passes parity when no keyword's vector drops below PARITY_MIN_COSINE and the
+# top-10 MeSH lists overlap by PARITY_MIN_OVERLAP on average
+PARITY_MIN_COSINE = 0.98
+PARITY_MIN_OVERLAP = 0.7
+PARITY_KEYWORDS = [
+    "heart attack", "myocardial infarction", "blood test", "blood sample test", "diabetes",
+    "insulin resistance", "breast cancer", "chemotherapy", "hypertension", "stroke",
+    "asthma", "chronic obstructive pulmonary disease", "depression", "cognitive behavioural therapy",
+    "covid-19", "vaccination", "randomized controlled trial", "systematic review",
+    "obesity in children", "hip fracture",
+]
+
+
+def load_encoder(checkpoint, model_config, encoder_config=None):
+    encoder_config = encoder_config or {}
+    backend = encoder_config.get('backend', 'torch')
+    if backend not in ENCODER_BACKENDS:
+        raise Exception("Encoder backend not valid")
+    configure_threads(encoder_config.get('threads'), encoder_config.get('inter_op_threads'))
+    if backend.startswith('torch'):
+        model = DenseModel.load(model_name_or_path=checkpoint, config=model_config)
+        if backend == 'torch-int8':
+            model = quantize_dense(model)
+    else:
+        path = ensure_onnx(checkpoint, model_config, encoder_config, quantized=backend == 'onnx-int8')
+        model = OnnxDenseModel(path, threads=encoder_config.get('threads'),
+                               inter_op_threads=encoder_config.get('inter_op_threads'))
+    return InferenceModel(model, compile=encoder_config.get('compile'))
+
+
+def ensure_onnx(checkpoint, model_config, encoder_config, quantized=False):
+    onnx_path = encoder_config.get('onnx_path', 'Model/encoder.onnx')
+    int8_path = encoder_config.get('onnx_int8_path', 'Model/encoder-int8.onnx')
+    if not os.path.exists(onnx_path) and not (quantized and os.path.exists(int8_path)):
+        print(f"Exporting {checkpoint} to {onnx_path}")
+        model = DenseModel.load(model_name_or_path=checkpoint, config=model_config)
+        export_onnx(model, onnx_path)
+    if not quantized:
+        return onnx_path
+    if not os.path.exists(int8_path):
+        print(f"Quantizing {onnx_path} to {int8_path}")
+        quantize_onnx(onnx_path, int8_path)
+    return int8_path
+
+
+def parity_report(reference, candidate, tokenizer, retriever, look_up, keywords, depth=10):
+    """Compare a backend with the PyTorch reference on the same keywords."""
+    from suggest_mesh_terms import encode_queries, search_queries
+
+    ref_reps = encode_queries(keywords, reference, tokenizer)
+    cand_reps = encode_queries(keywords, candidate, tokenizer)
+    cosine = numpy.sum(ref_reps * cand_reps, axis=1) / (
+        numpy.linalg.norm(ref_reps, axis=1) * numpy.linalg.norm(cand_reps, axis=1))
+    ref_uids = search_queries(retriever, ref_reps, look_up, depth)
+    cand_uids = search_queries(retriever, cand_reps, look_up, depth)
+    overlap = [len(set(a) & set(b)) / depth for a, b in zip(ref_uids, cand_uids)]
+
+    def latency_ms(model):
+        encode_queries(keywords[:1], model, tokenizer)  # warm-up
+        start = time.perf_counter()
+        for keyword in keywords:
+            encode_queries([keyword], model, tokenizer)
+        return (time.perf_counter() - start) * 1000 / len(keywords)
+
+    return {
+        "keywords": len(keywords),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "min_overlap": min(overlap),
+        "mean_overlap": sum(overlap) / len(overlap),
+        "reference_ms": latency_ms(reference),
+        "candidate_ms": latency_ms(candidate),
+    }
+
+
+if __name__ == '__main__':
+    from transformers import AutoConfig
+
+    from suggest_engine import load_config
+    from suggest_mesh_terms import load_retriever, load_tokenizer
+
+    parser = argparse.ArgumentParser(description="Export and check the query encoder backends")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("export", help="write the ONNX and int8 ONNX encoders named in config.json")
+    parity = subparsers.add_parser("parity", help="compare a backend with the PyTorch encoder")
+    parity.add_argument("--backend", choices=ENCODER_BACKENDS, help="default: encoder.backend of config.json")
+    parity.add_argument("--keywords", help="file with one keyword per line (default: built-in set)")
+    parity.add_argument("--min_cosine", type=float, default=PARITY_MIN_COSINE)
+    parity.add_argument("--min_overlap", type=float, default=PARITY_MIN_OVERLAP)
+    args = parser.parse_args()
+
+    config = load_config()
+    encoder_config = dict(config.get('encoder', {}))
+    cwd = os.getcwd() + '/'
+    checkpoint = cwd + "Model/checkpoint-80000/"
+    model_config = AutoConfig.from_pretrained(checkpoint, num_labels=1, cache_dir="cache/")
+
+    if args.command == "export":
+        print(ensure_onnx(checkpoint, model_config, encoder_config, quantized=True))
+        sys.exit(0)
+
+    if args.backend:
+        encoder_config['backend'] = args.backend
+    keywords = PARITY_KEYWORDS
+    if args.keywords:
+        with open(args.keywords, "r") as f:
+            keywords = [line.strip() for line in f if line.strip()]
+    tokenizer = load_tokenizer(config)
+    retriever, look_up = load_retriever(cwd, config.get('index', {}))
+    reference = load_encoder(checkpoint, model_config)
+    candidate = load_encoder(checkpoint, model_config, encoder_config)
+    report = parity_report(reference, candidate, tokenizer, retriever, look_up, keywords)
+    report["backend"] = encoder_config.get('backend', 'torch')
+    print(json.dumps(report, indent=2))
+    if report["min_cosine"] < args.min_cosine or report["mean_overlap"] < args.min_overlap:
+        sys.exit(1)
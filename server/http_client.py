@@ -0,0 +1,112 @@
+"""
+Pooled, concurrent HTTP access to the remote suggestion backends (E-utilities, UMLS).
+
+Suggestion engines are created per request, so the connection pool, the worker threads
+and the rate limiter live in one process-wide `BackendClient` per backend, obtained with
+`get_client`. Lookups for all keywords of a request run concurrently, capped both by the
+number of workers and by a requests-per-second limit (NCBI allows 10/s with an API key,
+3/s without).
+
+The limits are per process. Processes that share one API key must split it: prefork.py
+calls `share_rate_limits` in each worker, so the workers together stay within the limit.
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+NCBI_RATE_WITH_KEY = 10
+NCBI_RATE_WITHOUT_KEY = 3
+
+_rate_share = 1
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads."""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class BackendClient:
+    def __init__(self, max_workers=8, rate_per_second=None, timeout=10.0, retries=3, backoff=0.5):
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+        )
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="backend")
+        self.limiter = RateLimiter(rate_per_second) if rate_per_second else None
+
+    def get(self, url, params=None):
+        if self.limiter is not None:
+            self.limiter.acquire()
+        response = self.session.get(url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return response
+
+    def map(self, fn, items):
+        """Apply `fn` to every item concurrently; results come back in input order."""
+        return list(self.imap(fn, items))
+
+    def imap(self, fn, items):
+        """Like `map`, but yields each result as soon as it and every earlier one are done."""
+        items = list(items)
+        if len(items) <= 1:
+            return (fn(item) for item in items)
+        return self.executor.map(fn, items)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def share_rate_limits(processes):
+    """Give this process 1/`processes` of every rate limit (call before the first request)."""
+    global _rate_share
+    _rate_share = max(1, processes)
+
+
+def get_client(name, config, rate_per_second=None):
+    """Process-wide client for one backend, configured from the `http` section of config.json."""
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            http_config = config.get("http", {})
+            client = BackendClient(
+                max_workers=http_config.get("max_workers", 8),
+                rate_per_second=rate_per_second / _rate_share if rate_per_second else None,
+                timeout=http_config.get("timeout", 10.0),
+                retries=http_config.get("retries", 3),
+                backoff=http_config.get("backoff", 0.5),
+            )
+            _clients[name] = client
+        return client
+
+
+def ncbi_rate(config):
+    """E-utilities requests per second allowed for the configured API key."""
+    rate = config.get("http", {}).get("ncbi_rate_per_second")
+    if rate:
+        return rate
+    return NCBI_RATE_WITH_KEY if config.get("key") else NCBI_RATE_WITHOUT_KEY
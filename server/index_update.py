@@ -0,0 +1,203 @@
+"""
+Incremental index updates for new MeSH releases, and hot reload into running servers.
+
+MeSH is revised yearly and supplementary concepts weekly. Instead of re-encoding every
+descriptor, `python index_update.py new/mesh2.json` compares the new term list with
+data/mesh2.json and
+
+    added    encodes the new descriptors (passage side of the DenseModel) and adds
+             them to the index under fresh ids
+    changed  encodes the new term and replaces the old vector
+    retired  removes the vector from the index
+
+The index gets explicit ids on its first update (BaseFaissIPRetriever.with_ids): ids are
+positions in the uid lookup, which only ever grows (retired and replaced ids are never
+reused), so an id maps to the same uid in every version and a search on the old index can
+safely be resolved with the new lookup. The index, the lookup and mesh2.json are each written to
+a temporary file and renamed into place. The precomputed neighbour table
+(mesh_neighbours.py) no longer matches afterwards and is ignored until rebuilt.
+
+A running server picks up the new files on SIGUSR1 (main.py and asgi.py; the prefork.py
+parent reloads everything on SIGHUP or SIGUSR1). `reload_index` loads them next to the current ones and
+swaps retriever, lookup, MeSH dictionary, neighbour table and cache in one step:
+requests in flight finish on the engine they started with, nothing waits.
+
+    python index_update.py new/mesh2.json [--batch_size 256] [--dry_run]
+    kill -USR1 <server pid>
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+
+import numpy
+import torch
+
+from tevatron.faiss_retriever.__main__ import save_lookup
+
+_reload_lock = threading.Lock()
+
+
+def diff_mesh(mesh_dict, new_terms):
+    """(added, changed, retired) uids between the current uid -> term dict and a new mesh2.json list."""
+    new_dict = {item["uid"]: item["term"] for item in new_terms}
+    added = [uid for uid in new_dict if uid not in mesh_dict]
+    changed = [uid for uid in new_dict if uid in mesh_dict and mesh_dict[uid] != new_dict[uid]]
+    retired = [uid for uid in mesh_dict if uid not in new_dict]
+    return added, changed, retired
+
+
+def encode_passages(terms, model, tokenizer, batch_size=256, max_length=32):
+    """CLS vectors of MeSH terms through the passage side of the DenseModel."""
+    reps = []
+    for start in range(0, len(terms), batch_size):
+        batch = tokenizer(
+            terms[start:start + batch_size],
+            add_special_tokens=True,
+            max_length=max_length,
+            truncation=True,
+            padding='longest',
+            return_token_type_ids=False,
+            return_attention_mask=True,
+            return_tensors='pt'
+        )
+        with torch.inference_mode():
+            reps.append(model(passage=batch).p_reps.numpy())
+    return numpy.vstack(reps) if reps else numpy.zeros((0, 0), dtype=numpy.float32)
+
+
+def update_index(retriever, look_up, mesh_dict, new_terms, encode):
+    """
+    Apply a new mesh2.json list to a copy of the index. Returns the new retriever, lookup
+    and uid -> term dict and a report; the arguments are left untouched.
+    """
+    added, changed, retired = diff_mesh(mesh_dict, new_terms)
+    new_dict = {item["uid"]: item["term"] for item in new_terms}
+    retriever = retriever.with_ids()
+
+    removed = 0
+    if changed or retired:
+        stale = numpy.nonzero(numpy.isin(look_up, numpy.asarray(changed + retired)))[0]
+        removed = retriever.remove_ids(stale)
+
+    uids = added + changed
+    if uids:
+        reps = encode([new_dict[uid] for uid in uids])
+        if reps.shape[1] != retriever.index.d:
+            raise Exception(f"Encoder dimension {reps.shape[1]} does not match the index ({retriever.index.d})")
+        ids = numpy.arange(len(look_up), len(look_up) + len(uids), dtype=numpy.int64)
+        retriever.add_with_ids(reps, ids)
+        # concatenate widens the string dtype when new uids are longer
+        look_up = numpy.concatenate([look_up, numpy.asarray(uids)])
+    report = {
+        "added": len(added),
+        "changed": len(changed),
+        "retired": len(retired),
+        "removed_vectors": int(removed),
+        "ntotal": int(retriever.index.ntotal),
+        "lookup": len(look_up),
+    }
+    return retriever, look_up, new_dict, report
+
+
+def replace_file(path, write):
+    """Write through `write(tmp_path)`, then rename over `path` (readers see the old or the new file)."""
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_update(retriever, look_up, new_terms, index_config, mesh_path="data/mesh2.json"):
+    index_path = index_config.get('path', 'data/Encoding/mesh.index')
+    lookup_path = index_config.get('lookup', 'data/Encoding/passage_lookup.npy')
+    replace_file(index_path, retriever.save)
+    # numpy.save appends .npy to paths without it, so hand it an open file
+    replace_file(lookup_path, lambda tmp: _write_with(tmp, lambda f: save_lookup(f, look_up), "wb"))
+    replace_file(mesh_path, lambda tmp: _write_with(tmp, lambda f: json.dump(new_terms, f), "w"))
+
+
+def _write_with(path, write, mode):
+    with open(path, mode) as f:
+        write(f)
+
+
+def reload_index(resources, config):
+    """Swap the index, lookup, MeSH dictionary, neighbour table and cache on disk into `resources`."""
+    from mesh_neighbours import load_table
+    from suggest_mesh_terms import load_mesh_dict, load_retriever
+    from suggestion_cache import create_cache, engine_version
+
+    with _reload_lock:
+        start = time.perf_counter()
+        cwd = os.getcwd() + '/'
+        retriever, look_up = load_retriever(cwd, config.get('index', {}))
+        fresh = {
+            "retriever": retriever,
+            "look_up": look_up,
+            "mesh_dict": load_mesh_dict(cwd + "data/mesh2.json"),
+            "neighbours": load_table(config),
+            # cached uids belong to the old index; the new fingerprint starts a fresh cache
+            "cache": create_cache(config, engine_version(config)),
+        }
+        # one dict update: an engine created meanwhile gets either the old or the new set
+        resources.update(fresh)
+        print(f"Reloaded the index ({retriever.index.ntotal} vectors) in {time.perf_counter() - start:.1f}s")
+
+
+def reload_in_background(resources, config_loader):
+    """Signal handler body: reload without blocking the thread the signal interrupted."""
+    def run():
+        try:
+            reload_index(resources, config_loader())
+        except Exception as e:
+            print(f"Index reload failed, keeping the current index: {e}")
+
+    threading.Thread(target=run, name="reload-index", daemon=True).start()
+
+
+if __name__ == '__main__':
+    from transformers import AutoConfig
+
+    from suggest_engine import load_config
+    from suggest_mesh_terms import load_mesh_dict, load_retriever, load_tokenizer
+    from tevatron.modeling.dense import DenseModel
+
+    parser = argparse.ArgumentParser(description="Apply a new MeSH term list to the index incrementally")
+    parser.add_argument("mesh", help="new term list in the mesh2.json format")
+    parser.add_argument("--batch_size", type=int, default=256)
+    parser.add_argument("--dry_run", action="store_true", help="only report what would change")
+    args = parser.parse_args()
+
+    config = load_config()
+    cwd = os.getcwd() + '/'
+    with open(args.mesh, "r") as f:
+        new_terms = json.load(f)
+    mesh_dict = load_mesh_dict(cwd + "data/mesh2.json")
+    added, changed, retired = diff_mesh(mesh_dict, new_terms)
+    print(json.dumps({"added": len(added), "changed": len(changed), "retired": len(retired)}))
+    if args.dry_run or not (added or changed or retired):
+        raise SystemExit(0)
+
+    index_config = config.get('index', {})
+    # a private, writable copy: never modify a memory-mapped index in place
+    retriever, look_up = load_retriever(cwd, {**index_config, 'mmap': False})
+    checkpoint = cwd + "Model/checkpoint-80000/"
+    model = DenseModel.load(model_name_or_path=checkpoint,
+                            config=AutoConfig.from_pretrained(checkpoint, num_labels=1, cache_dir="cache/"))
+    tokenizer = load_tokenizer(config)
+    start = time.perf_counter()
+    retriever, look_up, _, report = update_index(
+        retriever, look_up, mesh_dict, new_terms,
+        lambda terms: encode_passages(terms, model, tokenizer, args.batch_size))
+    save_update(retriever, look_up, new_terms, index_config)
+    report["seconds"] = time.perf_counter() - start
+    print(json.dumps(report))
+    print("Load it with SIGUSR1 to main.py/asgi.py servers or SIGHUP to the prefork.py parent; "
+          "rebuild the neighbour table with `python mesh_neighbours.py`")
@@ -1,25 +1,63 @@
-from flask import Flask, jsonify, request
+import json
+import signal
+import time
+from flask import Flask, Response, g, jsonify, request
 from waitress import serve
-from suggest_mesh_terms import Suggest_MeSH_Terms_With_BERT, prepare_model
-from suggest_with_other import ATM_MeSH_Suggestion, MetaMap_MeSH_Suggestion, UMLS_MeSH_Suggestion
+import metrics
+from index_update import reload_in_background
+from resources import SUGGESTION_TYPES, ResourceLoader, create_engine
+from bulk_suggest import BULK_TYPES, bulk_suggest, read_queries
+from suggest_engine import load_config
+from suggest_mesh_terms import FUSION_METHODS
 app = Flask(__name__)
+loader = None
+resources = None
+server_timing = load_config().get("metrics", {}).get("server_timing", True)
 
 
-def get_mesh_suggestions(params):
-    BERT_Suggest = Suggest_MeSH_Terms_With_BERT(params)
-    return BERT_Suggest.suggest()
+@app.before_request
+def start_timing():
+    g.request_start = time.perf_counter()
+    metrics.start_request()
 
 
-def get_other_mesh_suggestion(params):
-    if params['payload']['Type'] == 'ATM':
-        ATM = ATM_MeSH_Suggestion(params)
-        return ATM.suggest()
-    elif params['payload']['Type'] == 'UMLS':
-        UMLS = UMLS_MeSH_Suggestion(params)
-        return UMLS.suggest()
-    elif params['payload']['Type'] == 'MetaMap':
-        MetaMap = MetaMap_MeSH_Suggestion(params)
-        return MetaMap.suggest()
+@app.after_request
+def record_timing(response):
+    timings = metrics.end_request()
+    if request.path.startswith("/api/v1/resources/mesh"):
+        seconds = time.perf_counter() - g.request_start
+        metrics.registry.observe_stage("request", seconds)
+        # only known types become label values: clients must not be able to add series
+        metrics.registry.count_request(metrics.request_label(request.args.get("type"), SUGGESTION_TYPES),
+                                       response.status_code)
+        if server_timing:
+            response.headers.add('Server-Timing', metrics.server_timing({**timings, "request": seconds}))
+    return response
+
+
+def not_ready(type):
+    """503 response while the components `type` needs are still loading (or failed to load)."""
+    missing = loader.missing(type) if loader is not None else []
+    if not missing:
+        return None
+    response = jsonify({"Error": f"Not ready for {type} suggestions", "Waiting": missing})
+    response.headers.add('Retry-After', '5')
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response, 503
+
+
+def invalid_fusion(fusion):
+    """400 response for a `fusion` parameter that names no fusion method."""
+    if not fusion or fusion in FUSION_METHODS:
+        return None
+    return jsonify({"Error": f"Fusion method not valid: {fusion}"}), 400
+
+
+def get_mesh_suggestions(payload):
+    engine = create_engine(resources, payload)
+    if engine is None:
+        return None
+    return engine.suggest()
 
 
 @app.route("/api/v1/resources/mesh", methods=['GET'])
@@ -29,24 +67,16 @@ def get_mesh():
     type = request.args.get("type")
     payload = {
         "Keywords": split_terms,
-        "Type": type
+        "Type": type,
+        "Fusion": request.args.get("fusion")
     }
-    if type in ['Semantic', 'Atomic', 'Fragment']:
-        params = {
-            "payload": payload,
-            "mesh_dict": mesh_dict,
-            "model": model,
-            "tokenizer": tokenizer,
-            "retriever": retriever,
-            "look_up": look_up,
-            "model_w2v": model_w2v
-        }
-        response = get_mesh_suggestions(params)
-    else:
-        params = {
-            "payload": payload
-        }
-        response = get_other_mesh_suggestion(params)
+    invalid = invalid_fusion(payload["Fusion"])
+    if invalid is not None:
+        return invalid
+    unavailable = not_ready(type)
+    if unavailable is not None:
+        return unavailable
+    response = get_mesh_suggestions(payload)
 
     formatted_response = {
         "Splits": split_terms,
@@ -57,12 +87,105 @@ def get_mesh():
     return response
 
 
+@app.route("/api/v1/resources/mesh/bulk", methods=['POST'])
+def post_mesh_bulk():
+    # JSONL in, JSONL out: one result line per query line, streamed as chunks complete
+    type = request.args.get("type", "Fragment")
+    if type not in BULK_TYPES:
+        return jsonify({"Error": f"Type not valid for bulk suggestion: {type}"}), 400
+    fusion = request.args.get("fusion")
+    invalid = invalid_fusion(fusion)
+    if invalid is not None:
+        return invalid
+    unavailable = not_ready(type)
+    if unavailable is not None:
+        return unavailable
+    try:
+        entries = list(read_queries(request.get_data(as_text=True).splitlines()))
+    except ValueError as e:
+        return jsonify({"Error": str(e)}), 400
+    results = bulk_suggest(entries, resources, type=type, fusion=fusion)
+    response = Response((json.dumps(result) + "\n" for result in results), mimetype='application/x-ndjson')
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/health", methods=['GET'])
+def get_health():
+    # liveness: the process is up and serving, whatever is still loading
+    report = loader.report() if loader is not None else {"ready": True}
+    return jsonify({"status": "ok", **report})
+
+
+@app.route("/ready", methods=['GET'])
+def get_ready():
+    # readiness: every component is loaded; per-type availability is in "types"
+    report = loader.report() if loader is not None else {"ready": True}
+    return jsonify(report), 200 if report["ready"] else 503
+
+
+@app.route("/api/v1/stats/batching", methods=['GET'])
+def get_batching_stats():
+    scheduler = resources["scheduler"]
+    stats = scheduler.metrics() if scheduler is not None else {"enabled": False}
+    response = jsonify(stats)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/api/v1/stats/cache", methods=['GET'])
+def get_cache_stats():
+    cache = resources["cache"]
+    stats = cache.stats() if cache is not None else {"enabled": False}
+    response = jsonify(stats)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/api/v1/stats/neighbours", methods=['GET'])
+def get_neighbours_stats():
+    table = resources["neighbours"]
+    stats = table.stats() if table is not None else {"enabled": False}
+    response = jsonify(stats)
+    response.headers.add('Access-Control-Allow-Origin', '*')
+    return response
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def _cache_stats():
+    cache = resources["cache"] if resources is not None else None
+    return cache.stats() if cache is not None else {}
+
+
+def _batching_stats():
+    scheduler = resources["scheduler"] if resources is not None else None
+    return scheduler.metrics() if scheduler is not None else {}
+
+
+def _neighbours_stats():
+    table = resources["neighbours"] if resources is not None else None
+    return table.stats() if table is not None else {}
+
+
+metrics.registry.register_collector("suggest_cache", _cache_stats)
+metrics.registry.register_collector("suggest_batching", _batching_stats)
+metrics.registry.register_collector("suggest_neighbours", _neighbours_stats)
+
+
 @app.errorhandler(404)
 def page_not_found(e):
     return "<h1>404</h1><p>The Resource You Requested Is Not Found.</p>", 404
 
 
 if __name__ == '__main__':
-    mesh_dict, model, tokenizer, retriever, look_up, model_w2v = prepare_model()
+    # start answering right away; components load in the background (see /ready)
+    loader = ResourceLoader().start()
+    resources = loader.resources
+    # SIGUSR1: swap in the index, lookup and MeSH terms written by index_update.py
+    signal.signal(signal.SIGUSR1, lambda signum, frame: reload_in_background(resources, load_config))
     # app.run()
     serve(app, host='127.0.0.1', port=5000)
@@ -0,0 +1,112 @@
+"""
+Offline MeSH translation index: the local fast path for ATM suggestions.
+
+PubMed's Automatic Term Mapping maps a keyword to the MeSH headings whose entry
+terms match it. `MeshTranslationIndex` does the same against a local MeSH descriptor
+dump (descYYYY.xml from NLM), mapping every heading, concept name and entry term,
+plus the terms of data/mesh2.json, to their heading, after normalization
+(lowercase, punctuation and extra spaces removed). Exact/normalized matches are
+answered from memory; anything else falls back to the remote E-utilities call.
+
+Build the compact JSON index once:
+
+    python mesh_index.py desc2024.xml data/mesh_atm_index.json
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+
+
+def normalize_term(term):
+    term = _PUNCTUATION.sub(" ", term.lower())
+    return " ".join(term.split())
+
+
+class MeshTranslationIndex:
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}  # normalized term -> [headings]
+
+    def add(self, term, heading):
+        key = normalize_term(term)
+        if not key:
+            return
+        headings = self.entries.setdefault(key, [])
+        if heading not in headings:
+            headings.append(heading)
+
+    def lookup(self, term):
+        """MeSH headings for the keyword, or None when the local index has no match."""
+        return self.entries.get(normalize_term(term))
+
+    def add_descriptor_dump(self, path):
+        """Index every heading, concept name and entry term of an NLM descYYYY.xml file."""
+        for _, record in ET.iterparse(path):
+            if record.tag != "DescriptorRecord":
+                continue
+            heading = record.findtext("DescriptorName/String")
+            if heading:
+                self.add(heading, heading)
+                for string in record.iterfind("ConceptList/Concept/ConceptName/String"):
+                    self.add(string.text, heading)
+                for string in record.iterfind("ConceptList/Concept/TermList/Term/String"):
+                    self.add(string.text, heading)
+            record.clear()
+
+    def add_mesh_dict(self, path):
+        with open(path, "r") as f:
+            for item in json.load(f):
+                self.add(item["term"], item["term"])
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.entries, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r") as f:
+            return cls(json.load(f))
+
+    def __len__(self):
+        return len(self.entries)
+
+
+def build_index(descriptor_path=None, mesh_dict_path=None):
+    index = MeshTranslationIndex()
+    if descriptor_path:
+        index.add_descriptor_dump(descriptor_path)
+    if mesh_dict_path:
+        index.add_mesh_dict(mesh_dict_path)
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index(config):
+    """Process-wide index from the `atm.local_index` path of config.json, or None if not built."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            path = config.get("atm", {}).get("local_index", "data/mesh_atm_index.json")
+            if not path or not os.path.exists(path):
+                return None
+            _index = MeshTranslationIndex.load(path)
+        return _index
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Build the offline MeSH translation index used by ATM")
+    parser.add_argument("descriptors", help="MeSH descriptor dump (descYYYY.xml)")
+    parser.add_argument("output", nargs="?", default="data/mesh_atm_index.json")
+    parser.add_argument("--mesh_dict", default="data/mesh2.json")
+    args = parser.parse_args()
+    built = build_index(args.descriptors, args.mesh_dict)
+    built.save(args.output)
+    print(f"Indexed {len(built)} normalized terms to {args.output}")
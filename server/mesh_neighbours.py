@@ -0,0 +1,162 @@
+"""
+Precomputed MeSH neighbourhood table: the exact-match fast path for Atomic suggestions.
+
+Many Atomic keywords are MeSH headings themselves. `MeshNeighbourTable` stores, for every
+term of data/mesh2.json, the top-k retriever results of that term, so such keywords are
+answered without the encoder or the FAISS index. A keyword matches when it equals a term
+up to case and whitespace, which the BERT tokenizer ignores anyway, so the answer is
+exactly what the encoder and index would return. With `normalized` enabled, keywords that
+only match after punctuation is removed as well (see mesh_index.normalize_term, e.g.
+"neoplasms breast" for "Neoplasms, Breast") get the results of that term too.
+
+The table is array-backed and saved as one .npz file: the sorted 64-bit hashes of the
+match keys, the row of each key, and an int32 (rows, k) matrix of positions in the index's
+uid lookup (-1 where the index returned fewer than k). It records the version of the
+engine it was built with (suggestion_cache.engine_version: model and encodings, encoder
+backend, index type and search parameters); a table that no longer matches is not used.
+
+    python mesh_neighbours.py [--depth 10] [--output data/mesh_neighbours.npz]
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+
+import numpy
+
+from mesh_index import normalize_term
+from suggestion_cache import engine_version
+
+
+def exact_key(term):
+    return " ".join(term.lower().split())
+
+
+def key_hash(key, normalized=False):
+    # normalized keys are hashed apart from exact ones, so the two never collide
+    return int.from_bytes(hashlib.blake2b((("\0" if normalized else "") + key).encode(), digest_size=8).digest(),
+                          "little")
+
+
+def table_version(config):
+    return engine_version(config)
+
+
+class MeshNeighbourTable:
+    def __init__(self, keys, rows, neighbours, version=""):
+        self.keys = keys              # sorted uint64 hashes of the match keys
+        self.rows = rows              # key -> row of neighbours
+        self.neighbours = neighbours  # (rows, depth) positions in the uid lookup, -1 padded
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self):
+        return self.neighbours.shape[1]
+
+    def _row(self, key, normalized=False):
+        key = numpy.uint64(key_hash(key, normalized))
+        i = numpy.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self.rows[i]
+        return None
+
+    def lookup(self, keyword, look_up, depth, normalized=False):
+        """Top-depth uids of the keyword, or None when it is not in the table."""
+        row = None
+        if depth <= self.depth:
+            row = self._row(exact_key(keyword))
+            if row is None and normalized:
+                row = self._row(normalize_term(keyword), normalized=True)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        positions = self.neighbours[row, :depth]
+        return look_up[positions[positions >= 0]].astype(str).tolist()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "keys": len(self.keys),
+                "rows": len(self.neighbours),
+                "depth": self.depth,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def save(self, path):
+        numpy.savez(path, keys=self.keys, rows=self.rows, neighbours=self.neighbours,
+                    version=numpy.array(self.version))
+
+    @classmethod
+    def load(cls, path):
+        with numpy.load(path, allow_pickle=False) as data:
+            return cls(data["keys"], data["rows"], data["neighbours"], str(data["version"]))
+
+
+def build_table(terms, encode, retriever, depth=10, batch_size=256, version=""):
+    """
+    Encode every distinct exact key of `terms` and keep its top-depth index positions.
+    Normalized keys point at the row of the first term they come from.
+    """
+    exact = list(dict.fromkeys(key for key in map(exact_key, terms) if key))
+    neighbours = numpy.full((len(exact), depth), -1, dtype=numpy.int32)
+    for start in range(0, len(exact), batch_size):
+        _, indices = retriever.search(encode(exact[start:start + batch_size]), depth)
+        neighbours[start:start + len(indices)] = indices
+    row_of = {key_hash(key): row for row, key in enumerate(exact)}
+    for term in terms:
+        normalized = normalize_term(term)
+        if normalized and exact_key(term):
+            row_of.setdefault(key_hash(normalized, normalized=True), row_of[key_hash(exact_key(term))])
+    keys = numpy.array(sorted(row_of), dtype=numpy.uint64)
+    rows = numpy.array([row_of[key] for key in sorted(row_of)], dtype=numpy.int32)
+    return MeshNeighbourTable(keys, rows, neighbours, version)
+
+
+def load_table(config):
+    """The table at `neighbours.path` of config.json, or None if disabled, not built or out of date."""
+    neighbours_config = config.get("neighbours", {})
+    path = neighbours_config.get("path", "data/mesh_neighbours.npz")
+    if not neighbours_config.get("enabled", True) or not path or not os.path.exists(path):
+        return None
+    table = MeshNeighbourTable.load(path)
+    if table.version != table_version(config):
+        print(f"Ignoring {path}: built for another model, encoder backend or index; rebuild it")
+        return None
+    return table
+
+
+if __name__ == '__main__':
+    import json
+
+    from suggest_engine import load_config
+    from suggest_mesh_terms import encode_queries, load_query_encoder, load_retriever, load_tokenizer
+
+    parser = argparse.ArgumentParser(description="Precompute the MeSH neighbourhood table for Atomic suggestions")
+    parser.add_argument("--mesh_dict", default="data/mesh2.json")
+    parser.add_argument("--output", help="default: neighbours.path of config.json")
+    parser.add_argument("--depth", type=int, help="results kept per term (default: fusion.depth of config.json)")
+    parser.add_argument("--batch_size", type=int, default=256)
+    args = parser.parse_args()
+
+    config = load_config()
+    cwd = os.getcwd() + '/'
+    model = load_query_encoder(cwd, config)
+    tokenizer = load_tokenizer(config)
+    retriever, _ = load_retriever(cwd, config.get('index', {}))
+    with open(args.mesh_dict, "r") as f:
+        terms = [item["term"] for item in json.load(f)]
+    depth = args.depth or config.get("fusion", {}).get("depth", 10)
+    table = build_table(terms, lambda keywords: encode_queries(keywords, model, tokenizer), retriever, depth,
+                        args.batch_size, table_version(config))
+    output = args.output or config.get("neighbours", {}).get("path", "data/mesh_neighbours.npz")
+    table.save(output)
+    print(f"Stored the top {depth} of {len(table.neighbours)} terms under {len(table.keys)} keys in {output}")
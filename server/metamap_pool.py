@@ -0,0 +1,146 @@
+"""
+Pool of long-lived MetaMap processes.
+
+Starting MetaMap loads its lexicon and data model, which dominates the cost of a
+one-keyword lookup. The pool keeps `workers` MetaMap processes running and feeds
+them keywords over stdin, one at a time per process. A process must answer every
+utterance with its output followed by a line equal to `end_marker`; for MetaMap's
+machine output (`-q`) that is the end-of-utterance line `'EOU'.`.
+
+MetaMap splits a keyword with sentence punctuation ("St. John's wort") into several
+utterances, so the number of end markers per keyword is not known in advance. Every
+keyword is therefore followed by a `sentinel` utterance, and the answer is everything
+up to the utterance that echoes the sentinel, which is read and dropped. A process that
+dies, closes its output or gives no answer within `timeout` seconds is killed, the
+lookup raises, and the process is restarted on the next lookup.
+"""
+
+import os
+import queue
+import re
+import select
+import shlex
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_CUI = re.compile(r"\bC\d{7}\b")
+# a word no vocabulary maps, so its utterance adds no CUIs
+DEFAULT_SENTINEL = "zzmetamappoolsentinel"
+DEFAULT_TIMEOUT = 30
+
+
+class MetaMapProcess:
+    def __init__(self, command, end_marker, sentinel=DEFAULT_SENTINEL, timeout=DEFAULT_TIMEOUT):
+        self.end_marker = end_marker
+        self.sentinel = sentinel
+        self.timeout = timeout
+        # unbuffered bytes, so select() on the pipe sees everything not yet consumed
+        self.proc = subprocess.Popen(
+            shlex.split(command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            bufsize=0,
+        )
+        self._buffer = b""
+
+    def _read_line(self, deadline):
+        while b"\n" not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.proc.stdout], [], [], remaining)[0]:
+                raise TimeoutError(f"MetaMap gave no answer within {self.timeout}s")
+            chunk = os.read(self.proc.stdout.fileno(), 65536)
+            if not chunk:
+                raise RuntimeError(f"MetaMap exited with code {self.proc.poll()}")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line.decode(errors="replace")
+
+    def _read_utterance(self, deadline):
+        lines = []
+        while True:
+            line = self._read_line(deadline)
+            if line.strip() == self.end_marker:
+                return lines
+            lines.append(line)
+
+    def query(self, term):
+        deadline = time.monotonic() + self.timeout
+        # no embedded line breaks; the sentinel goes in as an utterance of its own
+        self.proc.stdin.write((" ".join(term.split()) + "\n\n" + self.sentinel + "\n\n").encode())
+        self.proc.stdin.flush()
+        lines = []
+        while True:
+            utterance = self._read_utterance(deadline)
+            if any(self.sentinel in line for line in utterance):
+                return lines
+            lines.extend(utterance)
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+
+
+class MetaMapPool:
+    def __init__(self, command, workers=2, end_marker="'EOU'.", sentinel=DEFAULT_SENTINEL,
+                 timeout=DEFAULT_TIMEOUT):
+        self.command = command
+        self.end_marker = end_marker
+        self.sentinel = sentinel
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        for _ in range(workers):
+            self._idle.put(None)  # started on first use
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="metamap")
+
+    def query(self, term):
+        """MetaMap output lines for one keyword."""
+        process = self._idle.get()
+        try:
+            if process is None:
+                process = MetaMapProcess(self.command, self.end_marker, self.sentinel, self.timeout)
+            return process.query(term)
+        except Exception:
+            if process is not None:
+                process.close()
+            process = None
+            raise
+        finally:
+            self._idle.put(process)
+
+    def cuis(self, term):
+        """Distinct CUIs MetaMap maps the keyword to, in order of first mention."""
+        return list(dict.fromkeys(_CUI.findall("\n".join(self.query(term)))))
+
+    def map_cuis(self, terms):
+        return list(self.executor.map(self.cuis, terms))
+
+    def close(self):
+        while not self._idle.empty():
+            process = self._idle.get()
+            if process is not None:
+                process.close()
+        self.executor.shutdown()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(config):
+    """Process-wide MetaMap pool configured from the `metamap` section of config.json."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            metamap_config = config.get("metamap", {})
+            _pool = MetaMapPool(
+                metamap_config.get("command", "public_mm/bin/metamap -q"),
+                workers=metamap_config.get("workers", 2),
+                end_marker=metamap_config.get("end_marker", "'EOU'."),
+                sentinel=metamap_config.get("sentinel", DEFAULT_SENTINEL),
+                timeout=metamap_config.get("timeout", DEFAULT_TIMEOUT),
+            )
+        return _pool
@@ -0,0 +1,138 @@
+"""
+Lightweight per-stage latency instrumentation, exposed in the Prometheus text format.
+
+Code wraps each stage of a suggestion in `timed(stage)`: tokenize and forward (the
+encoder), encode (including cache lookups and micro-batching waits), search (FAISS),
+fusion, grouping (word2vec), mesh_terms (uid -> heading mapping), and the ATM, UMLS and
+MetaMap lookups. Every stage feeds the `suggest_stage_seconds` histogram; stages run on
+the request's own thread are also collected per request for the `Server-Timing` header.
+Requests are counted by type and status, and registered collectors export the cache and
+micro-batching statistics as gauges at scrape time.
+
+Metrics are per process: under prefork.py every worker keeps its own.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_request_timings = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = {}     # stage -> Histogram
+        self.requests = {}   # (type, status) -> count
+        self.collectors = {}  # prefix -> callable returning a (nested) dict of numbers
+
+    def observe_stage(self, stage, seconds):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def count_request(self, type, status):
+        key = (type or "", str(status))
+        with self._lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+    def register_collector(self, prefix, collect):
+        self.collectors[prefix] = collect
+
+    def render(self):
+        lines = [
+            "# HELP suggest_stage_seconds Time spent in each suggestion stage.",
+            "# TYPE suggest_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self.stages.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'suggest_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'suggest_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+                lines.append(f'suggest_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+                lines.append(f'suggest_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+            lines.append("# HELP suggest_requests_total Suggestion requests by type and HTTP status.")
+            lines.append("# TYPE suggest_requests_total counter")
+            for (type, status), count in sorted(self.requests.items()):
+                lines.append(f'suggest_requests_total{{type="{type}",status="{status}"}} {count}')
+        for prefix, collect in sorted(self.collectors.items()):
+            try:
+                values = collect()
+            except Exception as e:
+                print(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for name, value in _flatten(prefix, values or {}):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(prefix, values):
+    for key, value in values.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)):
+            yield name, float(value)
+
+
+registry = Registry()
+
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe_stage(stage, seconds)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def start_request():
+    """Begin collecting the stage timings of the request handled by this thread."""
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def end_request():
+    timings = _request_timings.get()
+    _request_timings.set(None)
+    return timings or {}
+
+
+def request_label(type, types):
+    """Counter label for a client-supplied `type`: itself if it is one of `types`, else "other"."""
+    return type if type in types else "other"
+
+
+def server_timing(timings):
+    """`Server-Timing` header value for the collected stage timings."""
+    return ", ".join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in timings.items())
@@ -0,0 +1,182 @@
+"""
+Persistent on-disk tier for SuggestionCache, shared by every worker process.
+
+Keyword encodings and top-k uids are stored in one SQLite database in WAL mode, which
+allows any number of concurrent readers alongside a writer across processes, and
+survives restarts. The in-process LRU stays in front of it for hot keywords.
+
+Pre-populate the store from a log of past queries (one JSON object per line, with
+`Keywords` (list), `term` ($-separated, as in the HTTP API) or `query` (boolean)):
+
+    python persistent_cache.py warm queries.jsonl
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from itertools import chain
+
+import numpy
+
+from suggestion_cache import normalize_keyword
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS vectors (
+    version TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    dim INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (version, keyword)
+);
+CREATE TABLE IF NOT EXISTS uids (
+    version TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    uids TEXT NOT NULL,
+    PRIMARY KEY (version, keyword, depth)
+);
+"""
+
+
+class SQLiteCacheStore:
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        # one connection per thread, and never one inherited across a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    # a locked or unreadable database degrades to a cache miss, never to a failed request
+
+    def get_vector(self, version, keyword):
+        try:
+            row = self._connection().execute(
+                "SELECT data FROM vectors WHERE version = ? AND keyword = ?", (version, keyword)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Suggestion cache read failed: {e}")
+            return None
+        return numpy.frombuffer(row[0], dtype=numpy.float32) if row is not None else None
+
+    def put_vectors(self, version, items):
+        """Store (keyword, q_rep) pairs in one transaction."""
+        rows = [(version, keyword, len(q_rep), numpy.asarray(q_rep, dtype=numpy.float32).tobytes())
+                for keyword, q_rep in items]
+        self._write("INSERT OR REPLACE INTO vectors VALUES (?, ?, ?, ?)", rows)
+
+    def get_uids(self, version, keyword, depth):
+        try:
+            row = self._connection().execute(
+                "SELECT uids FROM uids WHERE version = ? AND keyword = ? AND depth = ?",
+                (version, keyword, depth)).fetchone()
+        except sqlite3.Error as e:
+            print(f"Suggestion cache read failed: {e}")
+            return None
+        return json.loads(row[0]) if row is not None else None
+
+    def put_uids(self, version, depth, items):
+        """Store (keyword, uids) pairs in one transaction."""
+        rows = [(version, keyword, depth, json.dumps(list(uids))) for keyword, uids in items]
+        self._write("INSERT OR REPLACE INTO uids VALUES (?, ?, ?, ?)", rows)
+
+    def _write(self, statement, rows):
+        try:
+            with self._connection() as conn:
+                conn.executemany(statement, rows)
+        except sqlite3.Error as e:
+            print(f"Suggestion cache write failed: {e}")
+
+    def prune(self, keep_version):
+        """Drop entries written for any other model/index version."""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM vectors WHERE version != ?", (keep_version,))
+            conn.execute("DELETE FROM uids WHERE version != ?", (keep_version,))
+
+    def counts(self, version):
+        conn = self._connection()
+        return {
+            "vectors": conn.execute("SELECT COUNT(*) FROM vectors WHERE version = ?", (version,)).fetchone()[0],
+            "uids": conn.execute("SELECT COUNT(*) FROM uids WHERE version = ?", (version,)).fetchone()[0],
+        }
+
+
+def read_query_log(path):
+    """Yield the keywords of every query in a JSONL log."""
+    from query_parser import parse_boolean_query
+
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if "Keywords" in entry:
+                yield from entry["Keywords"]
+            elif "term" in entry:
+                yield from entry["term"].split("$")
+            elif "query" in entry:
+                yield from chain.from_iterable(parse_boolean_query(entry["query"]))
+
+
+def warm_up(store, version, keywords, model, tokenizer, retriever, look_up, batch_size=256, depth=10):
+    """Encode and search every distinct keyword not yet stored, in batches; returns how many were added."""
+    from suggest_mesh_terms import encode_queries, search_queries
+
+    pending = []
+    seen = set()
+    for keyword in keywords:
+        key = normalize_keyword(keyword)
+        if key and key not in seen:
+            seen.add(key)
+            if store.get_uids(version, key, depth) is None:
+                pending.append(key)
+
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        q_reps = encode_queries(batch, model, tokenizer)
+        store.put_vectors(version, zip(batch, q_reps))
+        store.put_uids(version, depth, zip(batch, search_queries(retriever, q_reps, look_up, depth)))
+    return len(pending)
+
+
+if __name__ == '__main__':
+    from suggest_engine import load_config
+    from suggest_mesh_terms import prepare_model
+    from suggestion_cache import create_cache, engine_version
+
+    parser = argparse.ArgumentParser(description="Manage the persistent suggestion cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    warm = commands.add_parser("warm", help="pre-populate the cache from a JSONL query log")
+    warm.add_argument("log")
+    warm.add_argument("--batch_size", type=int, default=256)
+    commands.add_parser("prune", help="drop entries of older model/index versions")
+    args = parser.parse_args()
+
+    config = load_config()
+    config.setdefault("cache", {})["enabled"] = True
+    cache = create_cache(config, engine_version(config))
+    if cache.store is None:
+        parser.error("cache.persistent.enabled is false in config.json")
+    if args.command == "warm":
+        mesh_dict, model, tokenizer, retriever, look_up, model_w2v = prepare_model(config)
+        added = warm_up(cache.store, cache.version, read_query_log(args.log), model, tokenizer, retriever,
+                        look_up, batch_size=args.batch_size)
+        print(f"Added {added} keywords, store now holds {cache.store.counts(cache.version)}")
+    else:
+        cache.store.prune(cache.version)
+        print(f"Pruned, store now holds {cache.store.counts(cache.version)}")
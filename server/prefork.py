@@ -0,0 +1,241 @@
+"""
+Pre-fork serving mode for the Flask API of main.py.
+
+The parent process loads the models, the FAISS index and word2vec once, binds the
+listening socket, and forks `prefork.workers` waitress workers that all accept on it.
+Workers share the parent's memory copy-on-write, and a prebuilt FAISS index and the
+word2vec vectors are memory-mapped, so their pages live once in the page cache. IVF
+inverted lists are mapped by every faiss version; flat and HNSW vectors only with a faiss
+that has IO_FLAG_MMAP_IFC. With an older faiss they are read into the parent's memory:
+the workers still share them copy-on-write, but other servers on the host do not.
+Each worker sets its own torch thread count (`prefork.torch_threads`, by default the
+cores divided by the workers) and starts its own micro-batching scheduler; HTTP clients
+and MetaMap processes are created lazily, so they too belong to the worker, and each
+worker gets 1/workers of the NCBI and UMLS rate limits. With an ONNX encoder backend each
+worker also opens its own ONNX Runtime session with that many threads, as the parent's
+is single-threaded; the session weights are then per worker.
+
+Signals to the parent:
+
+    SIGHUP, SIGUSR1  reload: load fresh resources and config, fork a new generation of
+                     workers, then gracefully stop the old ones (SIGUSR1 is what
+                     main.py and asgi.py take to swap in an index_update.py update)
+    SIGTERM, SIGINT  gracefully stop every worker, then exit
+
+A worker told to stop closes its listener, finishes the requests it has in flight (up to
+`prefork.graceful_timeout` seconds) and exits. Workers that die unexpectedly are replaced.
+
+    python prefork.py --host 127.0.0.1 --port 5000 --workers 4
+"""
+
+import argparse
+import gc
+import os
+import signal
+import socket
+import threading
+import time
+
+from waitress.channel import HTTPChannel
+from waitress.server import create_server
+
+import main
+from batch_scheduler import create_scheduler
+from http_client import share_rate_limits
+from resources import ResourceLoader
+from suggest_engine import load_config
+from tevatron.modeling.onnx_dense import OnnxDenseModel
+from tevatron.modeling.runtime import configure_threads
+
+
+def bind_socket(host, port, backlog=2048):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def load_shared_resources(config):
+    # the parent never runs the encoder with more than one thread: an OpenMP pool
+    # started before fork() is not usable in the children
+    parent_config = dict(config)
+    parent_config["encoder"] = {**config.get("encoder", {}), "threads": 1, "inter_op_threads": None}
+    loader = ResourceLoader(parent_config, start_scheduler=False).start()
+    try:
+        loader.wait()
+    finally:
+        # no loader threads may be left running at fork time
+        loader.shutdown()
+    # keep the cyclic GC in the workers from writing to (and so copying) the shared objects
+    gc.collect()
+    gc.freeze()
+    return loader
+
+
+def run_worker(sock, loader, config, settings):
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    configure_threads(settings["torch_threads"], 1)
+    # the workers share one NCBI API key: each gets its part of the rate limit
+    share_rate_limits(settings["workers"])
+    resources = loader.resources
+    encoder = resources["model"]
+    if isinstance(encoder.model, OnnxDenseModel):
+        encoder.model = encoder.model.with_threads(settings["torch_threads"], 1)
+    resources["scheduler"] = create_scheduler(resources["model"], resources["tokenizer"], config)
+    main.loader, main.resources = loader, resources
+    server = create_server(main.app, sockets=[sock], threads=settings["threads"])
+
+    def stop(signum, frame):
+        threading.Thread(target=drain, args=(server, settings["graceful_timeout"]), daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    print(f"Worker {os.getpid()} serving on {sock.getsockname()}")
+    server.run()
+    server.task_dispatcher.shutdown()
+    scheduler = main.resources["scheduler"]
+    if scheduler is not None:
+        scheduler.close()
+
+
+def drain(server, timeout):
+    """Stop accepting, wait for in-flight requests, then close everything so server.run() returns."""
+    def close_listener():
+        server.del_channel()
+        server.socket.close()
+
+    def close_all():
+        for channel in list(server._map.values()):
+            channel.close()
+
+    server.trigger.pull_trigger(close_listener)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        channels = [c for c in list(server._map.values()) if isinstance(c, HTTPChannel)]
+        if not any(c.requests or c.total_outbufs_len for c in channels):
+            break
+        time.sleep(0.1)
+    server.trigger.pull_trigger(close_all)
+
+
+class Arbiter:
+    def __init__(self, sock, config, settings):
+        self.sock = sock
+        self.config = config
+        self.settings = settings
+        self.loader = None
+        self.generation = 0
+        self.workers = {}  # pid -> generation
+        self.reload_requested = False
+        self.stop_requested = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                run_worker(self.sock, self.loader, self.config, self.settings)
+            except BaseException as e:
+                print(f"Worker {os.getpid()} failed: {e}")
+                status = 1
+            finally:
+                os._exit(status)
+        self.workers[pid] = self.generation
+
+    def run(self):
+        self.loader = load_shared_resources(self.config)
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGUSR1, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        for _ in range(self.settings["workers"]):
+            self.spawn()
+        print(f"Serving with {self.settings['workers']} workers, "
+              f"{self.settings['torch_threads']} encoder threads each (pid {os.getpid()})")
+        while not self.stop_requested:
+            if self.reload_requested:
+                self.reload_requested = False
+                self.reload()
+            self.reap()
+            time.sleep(0.5)
+        self.stop()
+
+    def on_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def on_stop(self, signum, frame):
+        self.stop_requested = True
+
+    def reap(self):
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            if generation == self.generation and not self.stop_requested:
+                print(f"Worker {pid} exited with status {status}, replacing it")
+                self.spawn()
+
+    def reload(self):
+        print("Reloading")
+        old_workers = list(self.workers)
+        gc.unfreeze()
+        try:
+            config = load_config()
+            loader = load_shared_resources(config)
+        except Exception as e:
+            gc.freeze()
+            print(f"Reload failed, keeping the current workers: {e}")
+            return
+        self.config, self.loader = config, loader
+        self.generation += 1
+        for _ in range(self.settings["workers"]):
+            self.spawn()
+        for pid in old_workers:
+            self.kill(pid, signal.SIGTERM)
+
+    def stop(self):
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + self.settings["graceful_timeout"] + 5
+        while self.workers and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in list(self.workers):
+            self.kill(pid, signal.SIGKILL)
+        self.sock.close()
+
+    def kill(self, pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            self.workers.pop(pid, None)
+
+
+def prefork_settings(config, workers=None):
+    prefork_config = config.get("prefork", {})
+    workers = workers or prefork_config.get("workers") or os.cpu_count() or 1
+    return {
+        "workers": workers,
+        "threads": prefork_config.get("threads", 4),
+        "torch_threads": prefork_config.get("torch_threads") or max(1, (os.cpu_count() or 1) // workers),
+        "graceful_timeout": prefork_config.get("graceful_timeout", 30),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MeSH Suggester pre-fork server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, help="default: prefork.workers of config.json, else one per core")
+    args = parser.parse_args()
+
+    config = load_config()
+    Arbiter(bind_socket(args.host, args.port), config, prefork_settings(config, args.workers)).run()
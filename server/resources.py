@@ -0,0 +1,141 @@
+"""
+Shared suggestion resources and per-request engine selection.
+
+Every front end (the Flask server in main.py, the ASGI server in asgi.py, the Gradio app)
+loads the models, index and caches once and picks the engine for a request with
+`create_engine`. `ResourceLoader` loads the components in parallel background threads and
+tracks the status and load time of each, so a server can start answering before all of
+them are in memory: ATM, UMLS and MetaMap need none, Atomic and Fragment everything but
+word2vec, and only Semantic waits for word2vec. No type waits for the optional MeSH
+neighbourhood table (mesh_neighbours.py). `load_resources` is the blocking form.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mesh_neighbours import load_table
+from suggest_engine import load_config
+from suggest_mesh_terms import (Suggest_MeSH_Terms_With_BERT, load_mesh_dict, load_query_encoder, load_retriever,
+                                load_tokenizer, load_w2v)
+from suggest_with_other import ATM_MeSH_Suggestion, MetaMap_MeSH_Suggestion, UMLS_MeSH_Suggestion
+from batch_scheduler import create_scheduler
+from suggestion_cache import create_cache, engine_version
+
+BERT_TYPES = ('Semantic', 'Atomic', 'Fragment')
+OTHER_ENGINES = {
+    'ATM': ATM_MeSH_Suggestion,
+    'UMLS': UMLS_MeSH_Suggestion,
+    'MetaMap': MetaMap_MeSH_Suggestion,
+}
+SUGGESTION_TYPES = BERT_TYPES + tuple(OTHER_ENGINES)
+COMPONENTS = ('mesh_dict', 'model', 'tokenizer', 'index', 'model_w2v', 'neighbours')
+TYPE_COMPONENTS = {
+    'Atomic': ('mesh_dict', 'model', 'tokenizer', 'index'),
+    'Fragment': ('mesh_dict', 'model', 'tokenizer', 'index'),
+    'Semantic': ('mesh_dict', 'model', 'tokenizer', 'index', 'model_w2v'),
+}
+
+
+class ResourceLoader:
+    def __init__(self, config=None, start_scheduler=True):
+        self.config = config if config is not None else load_config()
+        # a pre-fork parent defers the scheduler (a thread) to its workers
+        self.start_scheduler = start_scheduler
+        self.resources = {
+            "mesh_dict": None,
+            "model": None,
+            "tokenizer": None,
+            "retriever": None,
+            "look_up": None,
+            "model_w2v": None,
+            "neighbours": None,
+            "scheduler": None,
+            "cache": create_cache(self.config, engine_version(self.config)),
+        }
+        self.status = {name: {"status": "pending"} for name in COMPONENTS}
+        self.futures = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+        cwd = os.getcwd() + '/'
+        config = self.config
+        loaders = {
+            'mesh_dict': lambda: {"mesh_dict": load_mesh_dict(cwd + "data/mesh2.json")},
+            'model': lambda: {"model": load_query_encoder(cwd, config)},
+            'tokenizer': lambda: {"tokenizer": load_tokenizer(config)},
+            'index': lambda: dict(zip(("retriever", "look_up"), load_retriever(cwd, config.get('index', {})))),
+            'model_w2v': lambda: {"model_w2v": load_w2v(config)},
+            # optional Atomic fast path; no type waits for it
+            'neighbours': lambda: {"neighbours": load_table(config)},
+        }
+        self._executor = ThreadPoolExecutor(max_workers=len(loaders), thread_name_prefix="load")
+        for name, load in loaders.items():
+            self.futures[name] = self._executor.submit(self._load, name, load)
+        return self
+
+    def _load(self, name, load):
+        self.status[name] = {"status": "loading"}
+        start = time.perf_counter()
+        try:
+            values = load()
+        except Exception as e:
+            self.status[name] = {"status": "failed", "seconds": time.perf_counter() - start, "error": str(e)}
+            print(f"Failed to load {name}: {e}")
+            raise
+        self.resources.update(values)
+        self.status[name] = {"status": "ready", "seconds": time.perf_counter() - start}
+        print(f"Loaded {name} in {self.status[name]['seconds']:.1f}s")
+        if name in ('model', 'tokenizer'):
+            self._create_scheduler()
+
+    def _create_scheduler(self):
+        with self._lock:
+            if (self.start_scheduler and self.resources["scheduler"] is None
+                    and self.resources["model"] is not None and self.resources["tokenizer"] is not None):
+                self.resources["scheduler"] = create_scheduler(self.resources["model"], self.resources["tokenizer"],
+                                                               self.config)
+
+    def missing(self, type):
+        """Components the given suggestion type still waits for (loading or failed)."""
+        return [name for name in TYPE_COMPONENTS.get(type, ()) if self.status[name]["status"] != "ready"]
+
+    def wait(self, names=COMPONENTS, timeout=None):
+        """Block until the components are loaded; re-raises the error of a failed one."""
+        for name in names:
+            self.futures[name].result(timeout)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def report(self):
+        types = {type: not self.missing(type) for type in BERT_TYPES}
+        types.update({type: True for type in OTHER_ENGINES})
+        return {
+            "ready": all(component["status"] == "ready" for component in self.status.values()),
+            "components": self.status,
+            "types": types,
+        }
+
+
+def load_resources(config=None, start_scheduler=True):
+    loader = ResourceLoader(config, start_scheduler).start()
+    try:
+        loader.wait()
+    finally:
+        loader.shutdown()
+    return loader.resources
+
+
+def create_engine(resources, payload):
+    """The Suggestion engine for payload['Type'], or None for an unknown type."""
+    if payload['Type'] in BERT_TYPES:
+        return Suggest_MeSH_Terms_With_BERT({"payload": payload, **resources})
+    engine = OTHER_ENGINES.get(payload['Type'])
+    if engine is None:
+        return None
+    return engine({"payload": payload})
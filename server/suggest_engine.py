@@ -2,12 +2,17 @@ from abc import ABC, abstractmethod
 import json
 
 
+def load_config(path='./config.json'):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
 class Suggestion(ABC):
     @abstractmethod
     def __init__(self, params):
         self.params = params
         self.payload = self.params['payload']
-        self.config = json.loads(open('./config.json').read())
+        self.config = load_config()
 
     @abstractmethod
     def suggest(self):
@@ -19,3 +24,10 @@ class Suggestion(ABC):
         where key is index, and value is the MeSH term (String)
         """
         pass
+
+    def iter_suggest(self):
+        """
+        Yield the dictionaries returned by `suggest` one at a time, each as soon as it is computed.
+        Engines that can produce results incrementally override this.
+        """
+        yield from self.suggest()
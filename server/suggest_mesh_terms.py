@@ -1,15 +1,19 @@
-from tevatron.faiss_retriever.__main__ import pickle_load
+from tevatron.faiss_retriever.__main__ import pickle_load, load_lookup, npy_load
 from tevatron.faiss_retriever.retriever import BaseFaissIPRetriever
 from transformers import AutoConfig, AutoTokenizer
-from tevatron.modeling.dense import DenseModel
-from suggest_engine import Suggestion
+from encoder_backend import load_encoder
+from suggest_engine import Suggestion, load_config
+from w2v_store import load_word2vec
+from metrics import timed
 import os
 from itertools import chain
 import json
-from gensim.models import KeyedVectors
 from gensim.utils import tokenize
 import numpy
-import scipy
+import torch
+
+FUSION_METHODS = ('CombSUM', 'CombMNZ', 'RRF')
+BUCKET_SIZE = 64
 
 
 class Suggest_MeSH_Terms_With_BERT(Suggestion):
@@ -23,57 +27,110 @@ class Suggest_MeSH_Terms_With_BERT(Suggestion):
         self.look_up = self.params['look_up']
         self.mesh_dict = self.params['mesh_dict']
         self.model_w2v = self.params['model_w2v']
+        self.scheduler = self.params.get('scheduler')
+        self.cache = self.params.get('cache')
+        self.neighbours = self.params.get('neighbours')
+        self.neighbours_normalized = self.config.get('neighbours', {}).get('normalized', False)
+        self.fusion = fusion_settings(self.config, self.input_dict.get("Fusion"))
 
     def suggest(self):
+        return list(self.iter_suggest())
+
+    def iter_suggest(self):
         type = self.input_dict["Type"]
         keywords = self.input_dict["Keywords"]
         if len(keywords) > 0:
-            return_list = []
             if len(keywords) == 1:
                 type = "Atomic"
             if type == "Atomic":
-                for keyword in keywords:
-                    suggestion_uids = keyword_suggestion_method(keyword, self.model, self.tokenizer, self.retriever,
-                                                                self.look_up)
+                all_suggestion_uids = self.search_keywords(keywords, self.fusion["depth"])
+                for keyword, suggestion_uids in zip(keywords, all_suggestion_uids):
                     mesh_terms = get_mesh_terms(suggestion_uids, self.mesh_dict)
                     new_dict = {
                         "Keywords": [keyword],
                         "type": type,
                         "MeSH_Terms": mesh_terms
                     }
-                    return_list.append(new_dict)
-                return return_list
+                    yield new_dict
             elif type == "Semantic":
                 keyword_groups = seperate_keywords_group(keywords, self.model_w2v)
+                # encode every keyword of every group in one batch, then slice the rows back per group
+                q_reps = self.encode(list(chain.from_iterable(keyword_groups)))
+                start = 0
                 for keywords in keyword_groups:
-                    suggestion_uids = semantic_suggestion_method(keywords, self.model, self.tokenizer, self.retriever,
-                                                                 self.look_up)
+                    group_reps = q_reps[start:start + len(keywords)]
+                    start += len(keywords)
+                    if len(keywords) > 1:
+                        suggestion_uids = self.search_fused(group_reps)
+                    else:
+                        suggestion_uids = search_queries(self.retriever, group_reps, self.look_up,
+                                                         self.fusion["depth"])[0]
                     mesh_terms = get_mesh_terms(suggestion_uids, self.mesh_dict)
                     new_dict = {
                         "Keywords": keywords,
                         "type": type,
                         "MeSH_Terms": mesh_terms
                     }
-                    return_list.append(new_dict)
-                return return_list
+                    yield new_dict
             elif type == "Fragment":
-                suggestion_uids = fragment_suggestion_method(keywords, self.model, self.tokenizer, self.retriever,
-                                                             self.look_up)
+                q_reps = self.encode(keywords)
+                suggestion_uids = self.search_fused(q_reps)
                 mesh_terms = get_mesh_terms(suggestion_uids, self.mesh_dict)
                 new_dict = {
                     "Keywords": keywords,
                     "type": type,
                     "MeSH_Terms": mesh_terms
                 }
-                return_list.append(new_dict)
-                return return_list
+                yield new_dict
 
             else:
                 raise Exception("Type not valid")
         else:
             raise Exception("Minimum one keyword to suggest")
 
-
+    def search_keywords(self, keywords, depth):
+        # top-depth uids per keyword; MeSH terms (precomputed) and cached keywords skip both the encoder and the index
+        results = [lookup_neighbours(self.neighbours, keyword, self.look_up, depth, self.neighbours_normalized)
+                   for keyword in keywords]
+        if self.cache is not None:
+            results = [uids if uids is not None else self.cache.get_uids(keyword, depth)
+                       for keyword, uids in zip(keywords, results)]
+        missing = [i for i, uids in enumerate(results) if uids is None]
+        if missing:
+            missing_keywords = [keywords[i] for i in missing]
+            found = search_queries(self.retriever, self.encode(missing_keywords), self.look_up, depth)
+            for i, uids in zip(missing, found):
+                results[i] = uids
+            if self.cache is not None:
+                self.cache.put_uids(missing_keywords, depth, found)
+        return results
+
+    def search_fused(self, q_reps):
+        return search_queries_multiple(self.retriever, q_reps, self.look_up, self.fusion["depth"],
+                                       self.fusion["candidates"], self.fusion["method"], self.fusion["rrf_k"])
+
+    @timed("encode")
+    def encode(self, keywords):
+        if self.cache is None:
+            return self.encode_uncached(keywords)
+        vectors = [self.cache.get_vector(keyword) for keyword in keywords]
+        missing = [i for i, q_rep in enumerate(vectors) if q_rep is None]
+        if missing:
+            missing_keywords = [keywords[i] for i in missing]
+            q_reps = self.encode_uncached(missing_keywords)
+            for i, q_rep in zip(missing, q_reps):
+                vectors[i] = q_rep
+            self.cache.put_vectors(missing_keywords, q_reps)
+        return numpy.vstack(vectors)
+
+    def encode_uncached(self, keywords):
+        # go through the shared micro-batching scheduler when the server runs one
+        if self.scheduler is not None:
+            return self.scheduler.encode(keywords)
+        return encode_queries(keywords, self.model, self.tokenizer)
+
+
+@timed("mesh_terms")
 def get_mesh_terms(uids, mesh_dict):
     mesh_terms = {index: mesh_dict[uid] for index, uid in enumerate(uids) if uid in mesh_dict}
     return mesh_terms
@@ -90,71 +147,139 @@ def load_mesh_dict(path):
     return mesh_dict
 
 
-def prepare_model():
+def lookup_neighbours(table, keyword, look_up, depth, normalized=False):
+    if table is None:
+        return None
+    return table.lookup(keyword, look_up, depth, normalized)
+
+
+def fusion_settings(config, method=None):
+    """Depth, candidate k and fusion method from the `fusion` section of config.json; `method` overrides per request."""
+    settings = {"method": "CombSUM", "depth": 10, "candidates": 20, "rrf_k": 60}
+    settings.update(config.get("fusion", {}))
+    if method:
+        settings["method"] = method
+    if settings["method"] not in FUSION_METHODS:
+        raise ValueError(f"Fusion method not valid: {settings['method']}")
+    return settings
+
+
+def prepare_model(config=None):
     os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
     cwd = os.getcwd() + '/'
-    # load mesh_dict
-    mesh_path = cwd + "data/mesh2.json"
-    mesh_dict = load_mesh_dict(mesh_path)
+    if config is None:
+        config = load_config()
+    mesh_dict = load_mesh_dict(cwd + "data/mesh2.json")
+    model = load_query_encoder(cwd, config)
+    tokenizer = load_tokenizer(config)
+    # load_mesh_terms_encoded_and look_ups
+    retriever, look_up = load_retriever(cwd, config.get('index', {}))
+    model_w2v = load_w2v(config)
+
+    return mesh_dict, model, tokenizer, retriever, look_up, model_w2v
+
 
-    # load_model_for_query_encoding
+def load_query_encoder(cwd, config):
     num_labels = 1
-    config = AutoConfig.from_pretrained(
+    model_config = AutoConfig.from_pretrained(
         cwd + "Model/checkpoint-80000/",
         num_labels=num_labels,
         cache_dir="cache/",
     )
-    model = DenseModel.load(
-        model_name_or_path=cwd + "Model/checkpoint-80000/",
-        config=config,
-    )
-    tokenizer = AutoTokenizer.from_pretrained("dmis-lab/biobert-v1.1", cache_dir="cache/")
+    # the `encoder` section picks PyTorch or ONNX Runtime, full precision or int8
+    return load_encoder(cwd + "Model/checkpoint-80000/", model_config, config.get('encoder', {}))
 
-    # load_mesh_terms_encoded_and look_ups
-    look_up = []
-    p_reps, p_lookup = pickle_load(cwd + "data/Encoding/passage.pt")
-    retriever = BaseFaissIPRetriever(p_reps)
-    shards = chain([(p_reps, p_lookup)])
+
+def load_tokenizer(config=None):
+    # BioBERT's vocabulary from the Hugging Face hub unless `encoder.tokenizer` names another (local) one
+    name = (config or {}).get('encoder', {}).get('tokenizer', "dmis-lab/biobert-v1.1")
+    return AutoTokenizer.from_pretrained(name, cache_dir="cache/")
+
+
+def load_w2v(config):
+    w2v_config = config.get('word2vec', {})
+    return load_word2vec(w2v_config.get('path', 'Model/PubMed-w2v.kv'),
+                         w2v_config.get('binary', 'Model/PubMed-w2v.bin'))
+
+
+def load_retriever(cwd, index_config):
+    index_path = cwd + index_config.get('path', 'data/Encoding/mesh.index')
+    lookup_path = cwd + index_config.get('lookup', 'data/Encoding/passage_lookup.npy')
+    if os.path.exists(index_path) and os.path.exists(lookup_path):
+        # prebuilt by `python -m tevatron.faiss_retriever build`: no unpickling or re-adding at startup
+        retriever = BaseFaissIPRetriever.load(index_path, mmap=index_config.get('mmap', True),
+                                              nprobe=index_config.get('nprobe'),
+                                              ef_search=index_config.get('ef_search'))
+        return retriever, load_lookup(lookup_path)
+
+    reps_path = cwd + index_config.get('reps', 'data/Encoding/passage_reps.npy')
+    if os.path.exists(reps_path) and os.path.exists(lookup_path):
+        # written by `python -m tevatron.faiss_retriever convert`: memory-mapped, no pickle copy
+        shards = [npy_load(reps_path, lookup_path)]
+    else:
+        shards = [pickle_load(cwd + "data/Encoding/passage.pt")]
+    p_reps, p_lookup = shards[0]
+    # the `index` section picks flat (exact) or IVF/HNSW (approximate) search; IVF is trained on p_reps
+    retriever = BaseFaissIPRetriever.from_config(p_reps, index_config)
     for p_reps, p_lookup in shards:
         retriever.add(p_reps)
-        look_up += p_lookup
-    model_w2v = KeyedVectors.load_word2vec_format('Model/PubMed-w2v.bin', binary=True)
-
-    return mesh_dict, model, tokenizer, retriever, look_up, model_w2v
+    look_up = numpy.concatenate([numpy.asarray(p_lookup) for _, p_lookup in shards])
+    return retriever, look_up
 
 
 def search_queries(retriever, q_rep, lookup, depth):
-    all_scores, all_indices = retriever.search(q_rep, depth)
-    psg_indices = [[str(lookup[x]) for x in q_dd] for q_dd in all_indices]
+    with timed("search"):
+        all_scores, all_indices = retriever.search(q_rep, depth)
+    # approximate indexes pad with -1 when fewer than depth results are found
+    psg_indices = [lookup[q_dd[q_dd >= 0]].astype(str).tolist() for q_dd in all_indices]
     return psg_indices
 
 
-def search_queries_multiple(retriever, q_reps, lookup, depth):
-    returned_indices = []
-    overall_psg_indices = {}
-    for q_rep in q_reps:
-        all_scores, all_indices = retriever.search(q_rep, 20)
-        all_scores = all_scores[0]
-        psg_indices = [str(lookup[x]) for x in all_indices[0]]
-        min_score = min(all_scores)
-        diff_score = max(all_scores) - min(all_scores)
-        if diff_score == 0:
-            for i, p in psg_indices:
-                if psg_indices[i] not in overall_psg_indices:
-                    overall_psg_indices[psg_indices[i]] = 0
-
-        for i, s in enumerate(all_scores):
-            if psg_indices[i] not in overall_psg_indices:
-                overall_psg_indices[psg_indices[i]] = 0
-            normalised_score = (all_scores[i] - min_score) / diff_score
-            overall_psg_indices[psg_indices[i]] += normalised_score
-    sorted_dict = sorted(overall_psg_indices.items(), key=lambda x: x[1], reverse=True)
-    for sorted_item in sorted_dict[:depth]:
-        returned_indices.append(sorted_item[0])
-
-    return returned_indices
+def search_queries_multiple(retriever, q_reps, lookup, depth, candidates=20, method="CombSUM", rrf_k=60):
+    # one batched search for every query vector instead of one search per vector
+    with timed("search"):
+        all_scores, all_indices = retriever.search(numpy.vstack(q_reps), max(candidates, depth))
+    return fuse_results(all_scores, all_indices, lookup, depth, method, rrf_k)
+
+
+@timed("fusion")
+def fuse_results(all_scores, all_indices, lookup, depth, method="CombSUM", rrf_k=60):
+    """
+    Merge the ranked lists of several query vectors into one list of depth uids.
+    CombSUM adds each list's min-max normalized scores, CombMNZ multiplies that sum by the
+    number of lists the uid appears in, and RRF adds 1 / (rrf_k + rank). Ties keep the
+    order in which uids first appear.
+    """
+    all_scores = numpy.asarray(all_scores, dtype=numpy.float64)
+    all_indices = numpy.asarray(all_indices)
+    found = all_indices >= 0
+    if not found.any():
+        return []
+    if method == "RRF":
+        fused = 1.0 / (rrf_k + numpy.cumsum(found, axis=1))
+    elif method in ("CombSUM", "CombMNZ"):
+        min_score = numpy.min(all_scores, axis=1, initial=numpy.inf, where=found, keepdims=True)
+        max_score = numpy.max(all_scores, axis=1, initial=-numpy.inf, where=found, keepdims=True)
+        diff_score = max_score - min_score
+        # a list whose scores are all tied contributes its uids with a normalized score of 0
+        fused = numpy.zeros_like(all_scores)
+        numpy.divide(all_scores - min_score, diff_score, out=fused, where=found & (diff_score > 0))
+    else:
+        raise ValueError(f"Fusion method not valid: {method}")
+
+    uids, first_seen, inverse = numpy.unique(lookup[all_indices[found]], return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    totals = numpy.zeros(len(uids))
+    numpy.add.at(totals, inverse, fused[found])
+    if method == "CombMNZ":
+        list_ids = numpy.nonzero(found)[0]
+        hits = numpy.unique(list_ids * len(uids) + inverse) % len(uids)
+        totals *= numpy.bincount(hits, minlength=len(uids))
+    order = numpy.lexsort((first_seen, -totals))[:depth]
+    return uids[order].astype(str).tolist()
 
 
+@timed("grouping")
 def seperate_keywords_group(keywords, model_w2v):
     keywords = [k.lower() for k in keywords]
     key_ids = []
@@ -169,105 +294,75 @@ def seperate_keywords_group(keywords, model_w2v):
                 query_vectors.append(add_vector)
                 key_ids.append(key_index)
     if len(key_ids) > 1:
-        pairs = {}
-        for i in range(0, len(key_ids)):
-            score = [s[0] for s in scipy.spatial.distance.cdist(query_vectors, [query_vectors[i]], 'cosine')]
-            for s_index, s in enumerate(score):
-                if (s <= 0.2) and (s_index > i):
-                    if key_ids[i] in pairs:
-                        pairs[key_ids[i]].append(key_ids[s_index])
-                    else:
-                        exist = False
-                        for current_p in pairs:
-                            current_values = pairs[current_p]
-                            if (key_ids[i] in current_values) and (key_ids[s_index] in current_values):
-                                exist = True
-                                break
-                            elif key_ids[i] in current_values:
-                                pairs[current_p].append(key_ids[s_index])
-                                exist = True
-                                break
-                            elif key_ids[s_index] in current_values:
-                                pairs[current_p].append(key_ids[i])
-                                exist = True
-                                break
-                        if not exist:
-                            pairs[key_ids[i]] = [key_ids[s_index]]
-        already_appeared = set()
-        for p in pairs:
-            local_pairs = [keywords[p]]
-            already_appeared.add(p)
-            for a_p in pairs[p]:
-                already_appeared.add(a_p)
-                local_pairs.append(keywords[a_p])
-            keyword_groups.append(local_pairs)
-        for id in key_ids:
-            if id not in already_appeared:
-                keyword_groups.append([keywords[id]])
+        # cosine distances between all keyword vectors at once, then connected components
+        # of the "distance <= 0.2" graph; each group is listed in keyword order
+        vectors = numpy.asarray(query_vectors, dtype=numpy.float64)
+        norms = numpy.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = numpy.divide(vectors, norms, out=numpy.zeros_like(vectors), where=norms > 0)
+        nonzero = norms[:, 0] > 0
+        linked = (1.0 - vectors @ vectors.T <= 0.2) & nonzero[:, None] & nonzero[None, :]
+        rows, cols = numpy.nonzero(numpy.triu(linked, k=1))
+
+        parent = list(range(len(key_ids)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j in zip(rows, cols):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                # the smaller index stays the root so grouping never depends on edge order
+                parent[max(root_i, root_j)] = min(root_i, root_j)
+        groups = {}
+        for i, key_id in enumerate(key_ids):
+            groups.setdefault(find(i), []).append(keywords[key_id])
+        keyword_groups = list(groups.values())
     else:
         keyword_groups = [[k] for k in keywords]
 
     return keyword_groups
 
 
-def keyword_suggestion_method(keyword, model, tokenizer, retriever, look_up):
-    query = keyword.lower()
-    query_tokenised = tokenizer.encode_plus(
-        query,
-        add_special_tokens=True,
-        max_length=32,
-        truncation=True,
-        padding='max_length',
-        return_token_type_ids=False,
-        return_attention_mask=True,
-        return_tensors='pt'
-    )
-    encoded = model(query_tokenised)
-    uids = search_queries(retriever, encoded.q_reps.detach().numpy(), look_up, 10)
-    return uids[0]
-
-
-def semantic_suggestion_method(keywords, model, tokenizer, retriever, look_up):
-    encoded = []
-    for keyword in keywords:
-        query = keyword.lower()
-        query_tokenised = tokenizer.encode_plus(
-            query,
+def encode_queries(queries, model, tokenizer, bucket_size=BUCKET_SIZE):
+    """
+    Encode a list of keywords, one row per keyword in input order (float32, (len(queries), hidden_dim)).
+    Keywords are tokenized in one fast-tokenizer batch call, sorted by length and encoded in
+    buckets of at most bucket_size, each padded only to its own longest keyword.
+    """
+    queries = [query.lower() for query in queries]
+    with timed("tokenize"):
+        query_tokenised = tokenizer(
+            queries,
             add_special_tokens=True,
             max_length=32,
             truncation=True,
-            padding=False,
             return_token_type_ids=False,
-            return_attention_mask=True,
-            return_tensors='pt'
+            return_attention_mask=False,
         )
-        encoded.append(model(query_tokenised).q_reps.detach().numpy())
-    if len(encoded) > 1:
-        uids = [search_queries_multiple(retriever, encoded, look_up, 10)]
-    else:
-        uids = search_queries(retriever, encoded[0], look_up, 10)
-
-    return uids[0]
-
-
-def fragment_suggestion_method(keywords, model, tokenizer, retriever, look_up):
-    encoded = []
-    for keyword in keywords:
-        query = keyword.lower()
-        query_tokenised = tokenizer.encode_plus(
-            query,
-            add_special_tokens=True,
-            max_length=32,
-            truncation=True,
-            padding='max_length',
-            return_token_type_ids=False,
-            return_attention_mask=True,
-            return_tensors='pt'
-        )
-        encoded.append(model(query_tokenised).q_reps.detach().numpy())
-
-    uids = [search_queries_multiple(retriever, encoded, look_up, 10)]
-    return uids[0]
+    input_ids = query_tokenised['input_ids']
+    lengths = numpy.array([len(ids) for ids in input_ids])
+    order = numpy.argsort(lengths, kind='stable')
+    q_reps = None
+    for start in range(0, len(order), bucket_size):
+        bucket = order[start:start + bucket_size]
+        batch_ids = numpy.full((len(bucket), lengths[bucket].max()), tokenizer.pad_token_id, dtype=numpy.int64)
+        attention_mask = numpy.zeros_like(batch_ids)
+        for row, i in enumerate(bucket):
+            batch_ids[row, :lengths[i]] = input_ids[i]
+            attention_mask[row, :lengths[i]] = 1
+        with timed("forward"):
+            encoded = model({
+                'input_ids': torch.from_numpy(batch_ids),
+                'attention_mask': torch.from_numpy(attention_mask),
+            })
+        bucket_reps = encoded.q_reps.detach().numpy()
+        if q_reps is None:
+            q_reps = numpy.empty((len(queries), bucket_reps.shape[1]), dtype=bucket_reps.dtype)
+        q_reps[bucket] = bucket_reps
+    return q_reps
 
 
 if __name__ == '__main__':
@@ -1,8 +1,12 @@
 import json
-import requests
 import hashlib
-import subprocess
+from itertools import chain
 from suggest_engine import Suggestion
+from http_client import get_client, ncbi_rate
+from metamap_pool import get_pool
+from mesh_index import get_index
+from suggestion_cache import LRUCache
+from metrics import timed
 
 
 class ATM_MeSH_Suggestion(Suggestion):
@@ -10,100 +14,104 @@ class ATM_MeSH_Suggestion(Suggestion):
         super().__init__(params)
         self.url = self.config['url']
         self.key = self.config['key']
+        self.client = get_client("eutils", self.config, rate_per_second=ncbi_rate(self.config))
+        self.local_index = get_index(self.config)
+        self.remote_fallback = self.config.get('atm', {}).get('remote_fallback', True)
 
     def suggest(self):
+        return list(self.iter_suggest())
+
+    def iter_suggest(self):
         terms = self.payload['Keywords']
-        result = []
-        for term in terms:
-            mesh_for_single_term = {
-                "Keywords": [term],
-                "type": "ATM",
-                "MeSH_Terms": {}
-            }
-            url = f'{self.url}?db=pubmed&api_key={self.key}&retmode=json&term={term}'
-            response = requests.get(url)
-            content = json.loads(response.content)
-            print(content)
-            translation_stack = content["esearchresult"]["translationset"]
-            if len(translation_stack)==0:
-                continue
-            for item in translation_stack:
-                translated_terms = item['to'].split("OR")
-                for t in translated_terms:
-                    t = t.strip()
-                    if t.endswith("[MeSH Terms]"):
-                        for char in ['*', '"', '[MeSH Terms]', '"', '"']:
-                            mesh = t.replace(char, "")
-                        mesh_for_single_term['MeSH_Terms'][len(mesh_for_single_term['MeSH_Terms'])] = mesh
-                result.append(mesh_for_single_term)
-        return result
+        # one E-utilities round trip per keyword not found locally, issued concurrently over the shared session
+        for mesh_for_single_term in self.client.imap(self.suggest_term, terms):
+            if mesh_for_single_term is not None:
+                yield mesh_for_single_term
+
+    def suggest_term(self, term):
+        mesh_for_single_term = {
+            "Keywords": [term],
+            "type": "ATM",
+            "MeSH_Terms": {}
+        }
+        with timed("atm_local"):
+            headings = self.local_index.lookup(term) if self.local_index is not None else None
+        if headings is not None:
+            mesh_for_single_term['MeSH_Terms'] = {i: heading for i, heading in enumerate(headings)}
+            return mesh_for_single_term
+        if not self.remote_fallback:
+            return None
+        params = {"db": "pubmed", "api_key": self.key, "retmode": "json", "term": term}
+        with timed("atm_remote"):
+            content = json.loads(self.client.get(self.url, params=params).content)
+        translation_stack = content["esearchresult"]["translationset"]
+        if len(translation_stack) == 0:
+            return None
+        for item in translation_stack:
+            translated_terms = item['to'].split("OR")
+            for t in translated_terms:
+                t = t.strip()
+                if t.endswith("[MeSH Terms]"):
+                    mesh = t
+                    for char in ['*', '"', '[MeSH Terms]']:
+                        mesh = mesh.replace(char, "")
+                    mesh_for_single_term['MeSH_Terms'][len(mesh_for_single_term['MeSH_Terms'])] = mesh.strip()
+        return mesh_for_single_term
 
 
 class UMLS_MeSH_Suggestion(Suggestion):
     def __init__(self, params):
         super().__init__(params)
         self.base_url = self.config["umls_url"]
+        self.client = get_client("umls", self.config, rate_per_second=self.config.get("http", {}).get("umls_rate_per_second"))
 
     def suggest(self):
+        return list(self.iter_suggest())
+
+    def iter_suggest(self):
         terms = self.payload['Keywords']
-        result = []
+        yield from self.client.imap(self.suggest_term, terms)
 
-        for term in terms:
-            umls_terms = set()
-            res = requests.get(self.base_url + term)
-            dict_set = json.loads(res.text)
-            words = dict_set["hits"]["hits"]
-            for word in words:
-                #score = word["_score"]
-                sources = word["_source"]["thesaurus"]
-                for source in sources:
-                    if "MRCONSO_STR" in source:
-                        type = source['MRCONSO_SAB']
-                        if type=="MSH":
-                            mesh_term = source["MRCONSO_STR"]
-                            umls_terms.add(mesh_term)
-            m_dict = {i:t for i, t in enumerate(umls_terms)}
-            mesh_for_single_term = {
-                "Keywords": [term],
-                "type": "UMLS",
-                "MeSH_Terms": m_dict
-            }
+    def suggest_term(self, term):
+        umls_terms = set()
+        with timed("umls"):
+            res = self.client.get(self.base_url + term)
+        dict_set = json.loads(res.text)
+        words = dict_set["hits"]["hits"]
+        for word in words:
+            #score = word["_score"]
+            sources = word["_source"]["thesaurus"]
+            for source in sources:
+                if "MRCONSO_STR" in source:
+                    type = source['MRCONSO_SAB']
+                    if type=="MSH":
+                        mesh_term = source["MRCONSO_STR"]
+                        umls_terms.add(mesh_term)
+        m_dict = {i:t for i, t in enumerate(umls_terms)}
+        mesh_for_single_term = {
+            "Keywords": [term],
+            "type": "UMLS",
+            "MeSH_Terms": m_dict
+        }
+        return mesh_for_single_term
 
-            result.append(mesh_for_single_term)
-        return result
 
 class MetaMap_MeSH_Suggestion(Suggestion):
     def __init__(self, params):
         super().__init__(params)
         self.base_url = self.config["umls_url"]
+        self.client = get_client("umls", self.config, rate_per_second=self.config.get("http", {}).get("umls_rate_per_second"))
+        self.pool = get_pool(self.config)
 
     def suggest(self):
         terms = self.payload['Keywords']
         result = []
-        for term in terms:
-            umls_terms = set()
-            metamap_get_terms = subprocess.Popen('echo "' + term + '" | public_mm/bin/metamap -I', shell=True, stdout=subprocess.PIPE).stdout
-            metamap_terms = metamap_get_terms.read().decode().split('\n')
-
-            for metamap_term in metamap_terms:
-                chunks = metamap_term.split()
-                for chunk in chunks:
-                    if (":" in chunk) and ("C" in chunk):
-                        term_id = chunk.split(":")[0]
-                        print(term_id)
-                        res = requests.get(self.base_url + "cui:" + term_id)
-                        print(res)
-                        dict_set = json.loads(res.text)
-                        words = dict_set["hits"]["hits"]
-                        for word in words:
-                            # score = word["_score"]
-                            sources = word["_source"]["thesaurus"]
-                            for source in sources:
-                                if "MRCONSO_STR" in source:
-                                    type = source['MRCONSO_SAB']
-                                    if type == "MSH":
-                                        mesh_term = source["MRCONSO_STR"]
-                                        umls_terms.add(mesh_term)
+        with timed("metamap"):
+            cuis_per_term = self.pool.map_cuis(terms)
+        # every distinct CUI of the request is resolved once, and only if not resolved before
+        mesh_per_cui = self.resolve_cuis(set(chain.from_iterable(cuis_per_term)))
+        for term, term_ids in zip(terms, cuis_per_term):
+            umls_terms = dict.fromkeys(chain.from_iterable(mesh_per_cui[term_id] for term_id in term_ids))
             m_dict = {i: t for i, t in enumerate(umls_terms)}
             mesh_for_single_term = {
                 "Keywords": [term],
@@ -112,3 +120,39 @@ class MetaMap_MeSH_Suggestion(Suggestion):
             }
             result.append(mesh_for_single_term)
         return result
+
+    def resolve_cuis(self, term_ids):
+        mesh_per_cui = {}
+        missing = []
+        for term_id in term_ids:
+            mesh_terms = _cui_cache.get(term_id)
+            if mesh_terms is None:
+                missing.append(term_id)
+            else:
+                mesh_per_cui[term_id] = mesh_terms
+        for term_id, mesh_terms in zip(missing, self.client.map(self.cui_mesh_terms, missing)):
+            _cui_cache.put(term_id, mesh_terms)
+            mesh_per_cui[term_id] = mesh_terms
+        return mesh_per_cui
+
+    def cui_mesh_terms(self, term_id):
+        umls_terms = []
+        with timed("metamap_cui"):
+            res = self.client.get(self.base_url + "cui:" + term_id)
+        dict_set = json.loads(res.text)
+        words = dict_set["hits"]["hits"]
+        for word in words:
+            # score = word["_score"]
+            sources = word["_source"]["thesaurus"]
+            for source in sources:
+                if "MRCONSO_STR" in source:
+                    type = source['MRCONSO_SAB']
+                    if type == "MSH":
+                        mesh_term = source["MRCONSO_STR"]
+                        if mesh_term not in umls_terms:
+                            umls_terms.append(mesh_term)
+        return tuple(umls_terms)
+
+
+# CUI -> MeSH terms, shared by every MetaMap request of the process
+_cui_cache = LRUCache(maxsize=100000)
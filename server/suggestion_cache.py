@@ -0,0 +1,194 @@
+"""
+In-process cache of keyword encodings and BERT suggestion results.
+
+The same keywords recur across requests, so `SuggestionCache` keeps, per normalized
+keyword (lowercased, as the encoder sees it), the q_reps vector and the top-k uids
+returned by the retriever. Entries are tied to a version string derived from the
+model checkpoint and the index files; a new version drops every entry.
+An optional persistent store (see persistent_cache.py) backs the LRU so entries
+survive restarts and are shared between worker processes.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe, size-bounded LRU mapping with an optional time-to-live per entry."""
+
+    def __init__(self, maxsize=50000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def normalize_keyword(keyword):
+    return keyword.lower().strip()
+
+
+def cache_version(*paths):
+    """Fingerprint of the files under `paths` (name, size, mtime); changes whenever the model or index does."""
+    digest = hashlib.sha1()
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        for file in files:
+            if os.path.exists(file):
+                stat = os.stat(file)
+                digest.update(f"{file}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()[:16]
+
+
+# index settings that change search results, per index type
+INDEX_SETTINGS = {
+    "flat": (),
+    "ivf_flat": ("nlist", "nprobe"),
+    "ivf_pq": ("nlist", "pq_m", "pq_bits", "nprobe"),
+    "hnsw": ("hnsw_m", "ef_construction", "ef_search"),
+}
+
+
+def engine_version(config):
+    """
+    Version of everything cached vectors and uids depend on: the checkpoint and encoding
+    files (see cache_version), the encoder backend with its ONNX file (quantization is
+    part of the backend), and the index type with its build and search parameters.
+    """
+    encoder_config = config.get("encoder", {})
+    index_config = config.get("index", {})
+    backend = encoder_config.get("backend", "torch")
+    paths = ["Model/checkpoint-80000/", "data/Encoding/"]
+    if backend == "onnx":
+        paths.append(encoder_config.get("onnx_path", "Model/encoder.onnx"))
+    elif backend == "onnx-int8":
+        paths.append(encoder_config.get("onnx_int8_path", "Model/encoder-int8.onnx"))
+    index_type = index_config.get("type", "flat")
+    settings = "".join(f",{key}={index_config[key]}" for key in INDEX_SETTINGS.get(index_type, ())
+                       if index_config.get(key) is not None)
+    return f"{cache_version(*paths)}:{backend}:{index_type}{settings}"
+
+
+class SuggestionCache:
+    def __init__(self, version, maxsize=50000, ttl=None, store=None):
+        self.version = version
+        self.vectors = LRUCache(maxsize, ttl)
+        self.uids = LRUCache(maxsize, ttl)
+        self.store = store
+        self.store_hits = 0
+
+    def set_version(self, version):
+        """Invalidate everything cached for the previous model checkpoint / index."""
+        if version != self.version:
+            self.version = version
+            self.vectors.clear()
+            self.uids.clear()
+
+    def get_vector(self, keyword):
+        key = (self.version, normalize_keyword(keyword))
+        q_rep = self.vectors.get(key)
+        if q_rep is None and self.store is not None:
+            q_rep = self.store.get_vector(*key)
+            if q_rep is not None:
+                self.store_hits += 1
+                self.vectors.put(key, q_rep)
+        return q_rep
+
+    def put_vectors(self, keywords, q_reps):
+        # copy so the cached rows don't keep the whole encoded batch alive
+        items = [(normalize_keyword(keyword), q_rep.copy()) for keyword, q_rep in zip(keywords, q_reps)]
+        for keyword, q_rep in items:
+            self.vectors.put((self.version, keyword), q_rep)
+        if self.store is not None:
+            self.store.put_vectors(self.version, items)
+
+    def get_uids(self, keyword, depth):
+        key = (self.version, normalize_keyword(keyword), depth)
+        uids = self.uids.get(key)
+        if uids is None and self.store is not None:
+            uids = self.store.get_uids(*key)
+            if uids is not None:
+                self.store_hits += 1
+                uids = tuple(uids)
+                self.uids.put(key, uids)
+        return list(uids) if uids is not None else None
+
+    def put_uids(self, keywords, depth, all_uids):
+        items = [(normalize_keyword(keyword), tuple(uids)) for keyword, uids in zip(keywords, all_uids)]
+        for keyword, uids in items:
+            self.uids.put((self.version, keyword, depth), uids)
+        if self.store is not None:
+            self.store.put_uids(self.version, depth, items)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "vectors": self.vectors.stats(),
+            "uids": self.uids.stats(),
+            "store_hits": self.store_hits,
+        }
+
+
+def create_cache(config, version):
+    """Build the cache described by the `cache` section of config.json, or None when disabled."""
+    cache_config = config.get("cache", {})
+    if not cache_config.get("enabled", False):
+        return None
+    store = None
+    persistent = cache_config.get("persistent", {})
+    if persistent.get("enabled", False):
+        from persistent_cache import SQLiteCacheStore
+        store = SQLiteCacheStore(persistent.get("path", "cache/suggestions.sqlite3"))
+    return SuggestionCache(
+        version,
+        maxsize=cache_config.get("max_entries", 50000),
+        ttl=cache_config.get("ttl_seconds"),
+        store=store,
+    )
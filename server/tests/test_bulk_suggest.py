@@ -0,0 +1,24 @@
+import pytest
+
+from bulk_suggest import read_queries
+
+
+def test_read_queries_accepts_strings_and_objects():
+    lines = ['"heart attack AND aspirin"', '', '{"id": "q2", "query": "stroke"}', '{"query": "fever"}']
+    assert list(read_queries(lines)) == [
+        {"query": "heart attack AND aspirin", "id": 0},
+        {"id": "q2", "query": "stroke"},
+        {"query": "fever", "id": 3},
+    ]
+
+
+@pytest.mark.parametrize("line, message", [
+    ('[1, 2]', 'expected a query string or an object'),
+    ('7', 'expected a query string or an object'),
+    ('{"id": 1}', '"query" must be a string'),
+    ('{"query": ["stroke"]}', '"query" must be a string'),
+    ('{"query": ', 'invalid JSON'),
+])
+def test_read_queries_rejects_invalid_lines_with_their_number(line, message):
+    with pytest.raises(ValueError, match=f"Line 2: .*{message}"):
+        list(read_queries(['"stroke"', line]))
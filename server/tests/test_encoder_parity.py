@@ -0,0 +1,46 @@
+import pytest
+from transformers import AutoConfig
+
+from benchmark.run import load_queries
+from benchmark.synthetic import build_workspace
+from encoder_backend import PARITY_MIN_COSINE, PARITY_MIN_OVERLAP, load_encoder, parity_report
+from suggest_mesh_terms import load_retriever, load_tokenizer
+
+
+@pytest.fixture(scope="module")
+def workspace(tmp_path_factory):
+    return str(build_workspace(str(tmp_path_factory.mktemp("parity")), terms=1000)) + "/"
+
+
+@pytest.fixture(scope="module")
+def reference(workspace):
+    checkpoint = workspace + "Model/checkpoint-80000/"
+    model_config = AutoConfig.from_pretrained(checkpoint, num_labels=1)
+    tokenizer = load_tokenizer({"encoder": {"tokenizer": workspace + "Model/tokenizer"}})
+    retriever, look_up = load_retriever(workspace, {"type": "flat"})
+    keywords = list(dict.fromkeys(keyword for query in load_queries() for keyword in query["keywords"]))
+    return {
+        "checkpoint": checkpoint,
+        "model_config": model_config,
+        "model": load_encoder(checkpoint, model_config),
+        "tokenizer": tokenizer,
+        "retriever": retriever,
+        "look_up": look_up,
+        "keywords": keywords,
+    }
+
+
+@pytest.mark.parametrize("backend", ["torch-int8", "onnx", "onnx-int8"])
+def test_backend_matches_pytorch(reference, workspace, backend):
+    if backend.startswith("onnx"):
+        pytest.importorskip("onnxruntime")
+    encoder_config = {
+        "backend": backend,
+        "onnx_path": workspace + "Model/encoder.onnx",
+        "onnx_int8_path": workspace + "Model/encoder-int8.onnx",
+    }
+    candidate = load_encoder(reference["checkpoint"], reference["model_config"], encoder_config)
+    report = parity_report(reference["model"], candidate, reference["tokenizer"], reference["retriever"],
+                           reference["look_up"], reference["keywords"])
+    assert report["min_cosine"] >= PARITY_MIN_COSINE, report
+    assert report["mean_overlap"] >= PARITY_MIN_OVERLAP, report
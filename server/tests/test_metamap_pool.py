@@ -0,0 +1,59 @@
+import sys
+import textwrap
+import time
+
+import pytest
+
+from metamap_pool import MetaMapPool
+
+# answers like `metamap -q`: one utterance per sentence of an input line, each closed by 'EOU'.
+FAKE_METAMAP = textwrap.dedent('''
+    import re
+    import sys
+    import time
+
+    CUIS = {"john": "C0000001", "wort": "C0000002", "aspirin": "C0000003", "fever": "C0000004"}
+    count = 0
+    for line in sys.stdin:
+        for sentence in re.split(r"(?<=[.?!])\\s+", line.strip()):
+            if not sentence:
+                continue
+            if "hang" in sentence:
+                time.sleep(60)
+            count += 1
+            print(f"utterance('00000000.tx.{count}',\\"{sentence}\\",0/{len(sentence)},[]).")
+            for word in re.findall(r"[a-z]+", sentence.lower()):
+                if word in CUIS:
+                    print(f"mapping([ev(-1000,'{CUIS[word]}','{word}')]).")
+            print("'EOU'.")
+        sys.stdout.flush()
+''')
+
+
+@pytest.fixture
+def pool(tmp_path):
+    script = tmp_path / "metamap.py"
+    script.write_text(FAKE_METAMAP)
+    pool = MetaMapPool(f"{sys.executable} {script}", workers=1, timeout=2)
+    yield pool
+    pool.close()
+
+
+def test_single_utterance(pool):
+    assert pool.cuis("aspirin") == ["C0000003"]
+
+
+def test_multi_sentence_term_does_not_leak_into_next_query(pool):
+    assert pool.cuis("St. John's wort") == ["C0000001", "C0000002"]
+    assert pool.cuis("aspirin") == ["C0000003"]
+    assert pool.cuis("e.g. fever. Or aspirin?") == ["C0000004", "C0000003"]
+    assert pool.cuis("fever") == ["C0000004"]
+
+
+def test_stalled_process_times_out_and_is_restarted(pool):
+    assert pool.cuis("aspirin") == ["C0000003"]
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        pool.cuis("hang")
+    assert time.monotonic() - started < 5
+    assert pool.cuis("fever") == ["C0000004"]
@@ -1,11 +1,198 @@
-"""pickle_load — shim for tevatron.faiss_retriever.__main__.pickle_load"""
+"""pickle_load — shim for tevatron.faiss_retriever.__main__.pickle_load
 
+Also a small command line for the offline side of the index:
+
+    python -m tevatron.faiss_retriever build --passage_reps data/Encoding/passage.pt
+
+writes the populated FAISS index and a compact uid lookup (paths and index type
+from config.json's `index` section) for `prepare_model` to memory-map,
+
+    python -m tevatron.faiss_retriever convert --passage_reps data/Encoding/passage.pt --fp16
+
+rewrites the pickled encodings as a raw .npy matrix plus .npy uid lookup that
+`npy_load` maps without copying, and
+
+    python -m tevatron.faiss_retriever recall --passage_reps data/Encoding/passage.pt \
+        --index_type hnsw --ef_search 32 64 128
+
+prints one JSON line per setting with recall@k against the exact flat index.
+"""
+
+import argparse
+import json
+import os
 import pickle
+import time
+
 import numpy as np
 
+from .retriever import INDEX_TYPES, BaseFaissIPRetriever
+
 
 def pickle_load(path: str):
     """Load (reps, lookup) from a pickle file produced by tevatron encoding."""
     with open(path, "rb") as f:
         reps, lookup = pickle.load(f)
-    return np.array(reps), lookup
+    # asarray: no second copy when the pickle already holds an ndarray
+    return np.asarray(reps), lookup
+
+
+def npy_load(reps_path: str, lookup_path: str, mmap: bool = True):
+    """
+    Load (reps, lookup) written by `convert`. With `mmap` the reps stay a read-only
+    view of the file (float16 or float32, as stored) instead of a private copy.
+    """
+    reps = np.load(reps_path, mmap_mode="r" if mmap else None, allow_pickle=False)
+    return reps, load_lookup(lookup_path)
+
+
+def recall_report(reps: np.ndarray, queries: np.ndarray, index_configs, k: int = 10):
+    """
+    Compare approximate index settings against exact flat search.
+
+    For each entry of `index_configs` (dicts in the format of config.json's `index`
+    section) yields recall@k against the flat top-k, the fraction of queries whose
+    top-k is identical (same uids, same order) and the mean search time per query.
+    """
+    reps = np.ascontiguousarray(reps, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = BaseFaissIPRetriever(reps)
+    exact.add(reps)
+    _, truth = exact.search(queries, k)
+
+    for index_config in index_configs:
+        started = time.perf_counter()
+        retriever = BaseFaissIPRetriever.from_config(reps, index_config)
+        retriever.add(reps)
+        build_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        _, found = retriever.search(queries, k)
+        search_seconds = time.perf_counter() - started
+
+        hits = sum(len(set(t) & set(f)) for t, f in zip(truth, found))
+        yield {
+            **index_config,
+            "recall@%d" % k: hits / truth.size,
+            "identical@%d" % k: float(np.mean(np.all(truth == found, axis=1))),
+            "search_ms_per_query": 1000.0 * search_seconds / len(queries),
+            "build_seconds": build_seconds,
+        }
+
+
+def save_lookup(path: str, lookup) -> None:
+    """Store the uid lookup as a plain NumPy array (no pickle needed to read it back)."""
+    np.save(path, np.asarray(lookup), allow_pickle=False)
+
+
+def load_lookup(path: str) -> np.ndarray:
+    return np.load(path, allow_pickle=False)
+
+
+def _index_config(config_path):
+    if config_path and os.path.exists(config_path):
+        with open(config_path) as f:
+            return json.load(f).get("index", {})
+    return {}
+
+
+def _build(args):
+    index_config = _index_config(args.config)
+    index_path = args.index or index_config.get("path", "data/Encoding/mesh.index")
+    lookup_path = args.lookup or index_config.get("lookup", "data/Encoding/passage_lookup.npy")
+
+    started = time.perf_counter()
+    if args.passage_reps.endswith(".npy"):
+        reps, lookup = npy_load(args.passage_reps, lookup_path)
+    else:
+        reps, lookup = pickle_load(args.passage_reps)
+    retriever = BaseFaissIPRetriever.from_config(reps, index_config)
+    retriever.add(reps)
+    retriever.save(index_path)
+    save_lookup(lookup_path, lookup)
+    print(json.dumps({
+        "index": index_path,
+        "lookup": lookup_path,
+        "type": retriever.index_type,
+        "ntotal": retriever.index.ntotal,
+        "seconds": time.perf_counter() - started,
+    }))
+
+
+def _convert(args):
+    index_config = _index_config(args.config)
+    reps_path = args.reps or index_config.get("reps", "data/Encoding/passage_reps.npy")
+    lookup_path = args.lookup or index_config.get("lookup", "data/Encoding/passage_lookup.npy")
+
+    reps, lookup = pickle_load(args.passage_reps)
+    reps = reps.astype(np.float16 if args.fp16 else np.float32, copy=False)
+    np.save(reps_path, reps, allow_pickle=False)
+    save_lookup(lookup_path, lookup)
+    print(json.dumps({
+        "reps": reps_path,
+        "lookup": lookup_path,
+        "shape": list(reps.shape),
+        "dtype": str(reps.dtype),
+    }))
+
+
+def _recall(args):
+    reps, _ = pickle_load(args.passage_reps)
+    if args.queries:
+        queries = np.load(args.queries)
+    else:
+        # without encoded query logs, probe with a random sample of the MeSH encodings themselves
+        rng = np.random.default_rng(args.seed)
+        queries = reps[rng.choice(len(reps), size=min(args.num_queries, len(reps)), replace=False)]
+
+    index_configs = []
+    for nprobe in args.nprobe:
+        for ef_search in args.ef_search:
+            index_configs.append({
+                "type": args.index_type, "nlist": args.nlist, "pq_m": args.pq_m, "hnsw_m": args.hnsw_m,
+                "nprobe": nprobe, "ef_search": ef_search,
+            })
+    for row in recall_report(reps, queries, index_configs, k=args.k):
+        print(json.dumps(row), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m tevatron.faiss_retriever")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="write a serialized FAISS index and uid lookup")
+    build.add_argument("--passage_reps", default="data/Encoding/passage.pt",
+                       help="pickled passage.pt, or a .npy matrix written by `convert`")
+    build.add_argument("--config", default="config.json", help="config.json whose `index` section to use")
+    build.add_argument("--index", default=None, help="output index path (default: index.path)")
+    build.add_argument("--lookup", default=None, help="output lookup path (default: index.lookup)")
+    build.set_defaults(func=_build)
+
+    convert = commands.add_parser("convert", help="rewrite pickled encodings as .npy reps + .npy lookup")
+    convert.add_argument("--passage_reps", default="data/Encoding/passage.pt")
+    convert.add_argument("--config", default="config.json", help="config.json whose `index` section to use")
+    convert.add_argument("--reps", default=None, help="output reps path (default: index.reps)")
+    convert.add_argument("--lookup", default=None, help="output lookup path (default: index.lookup)")
+    convert.add_argument("--fp16", action="store_true", help="store the reps as float16 (half the size)")
+    convert.set_defaults(func=_convert)
+
+    recall = commands.add_parser("recall", help="recall@k of approximate index settings vs the flat index")
+    recall.add_argument("--passage_reps", default="data/Encoding/passage.pt")
+    recall.add_argument("--queries", default=None, help=".npy array of encoded queries (optional)")
+    recall.add_argument("--num_queries", type=int, default=1000)
+    recall.add_argument("--seed", type=int, default=42)
+    recall.add_argument("--index_type", choices=INDEX_TYPES, default="hnsw")
+    recall.add_argument("--nlist", type=int, default=1024)
+    recall.add_argument("--pq_m", type=int, default=16)
+    recall.add_argument("--hnsw_m", type=int, default=32)
+    recall.add_argument("--nprobe", type=int, nargs="+", default=[32])
+    recall.add_argument("--ef_search", type=int, nargs="+", default=[128])
+    recall.add_argument("--k", type=int, default=10)
+    recall.set_defaults(func=_recall)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
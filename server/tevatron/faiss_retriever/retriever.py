@@ -1,18 +1,192 @@
-"""BaseFaissIPRetriever — shim for tevatron.faiss_retriever.retriever"""
+"""BaseFaissIPRetriever — shim for tevatron.faiss_retriever.retriever
+
+Besides the exact flat index of the original tevatron retriever, the index can be
+an approximate one (IVF-Flat, IVF-PQ or HNSW), all scored by inner product.
+A populated index can be written once with `save` and memory-mapped by every
+worker process with `load`. `with_ids` gives it explicit ids (the positions of the
+uid lookup) so that vectors can be added and removed one by one when MeSH changes,
+without rebuilding the whole index.
+"""
 
 import faiss
 import numpy as np
 
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+_INDEX_CLASSES = {
+    "IndexFlatIP": "flat",
+    "IndexIVFFlat": "ivf_flat",
+    "IndexIVFPQ": "ivf_pq",
+    "IndexHNSWFlat": "hnsw",
+}
+
+
+def build_index(dim: int, index_type: str = "flat", nlist: int = 1024, pq_m: int = 16,
+                pq_bits: int = 8, hnsw_m: int = 32, ef_construction: int = 200):
+    """Create an empty (possibly untrained) inner-product index of the given type."""
+    if index_type == "flat":
+        return faiss.IndexFlatIP(dim)
+    if index_type == "ivf_flat":
+        quantizer = faiss.IndexFlatIP(dim)
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "ivf_pq":
+        quantizer = faiss.IndexFlatIP(dim)
+        return faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_bits, faiss.METRIC_INNER_PRODUCT)
+    if index_type == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = ef_construction
+        return index
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+
+def _mmap_flags(path: str) -> int:
+    """
+    Read flags that map the vectors of the index at `path` instead of copying them.
+    IO_FLAG_MMAP only maps IVF inverted lists; the flat codes of IndexFlat and HNSW
+    (also inside an IndexIDMap2) need the zero-copy reader of IO_FLAG_MMAP_IFC,
+    which older faiss versions do not have.
+    """
+    with open(path, "rb") as f:
+        fourcc = f.read(4)
+    # every IVF index type is written under a fourcc starting with "Iw" (or "Iv" for old files)
+    if fourcc[:2] in (b"Iw", b"Iv") or not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP_IFC
+
+
+def _empty_copy(index):
+    """An empty index with the settings of `index`."""
+    empty = faiss.clone_index(index)
+    empty.reset()
+    return empty
+
 
 class BaseFaissIPRetriever:
-    """Inner-product FAISS retriever (flat index)."""
+    """Inner-product FAISS retriever (flat index by default)."""
 
-    def __init__(self, init_reps: np.ndarray):
+    def __init__(self, init_reps: np.ndarray, index_type: str = "flat", nlist: int = 1024,
+                 pq_m: int = 16, pq_bits: int = 8, hnsw_m: int = 32, ef_construction: int = 200,
+                 nprobe: int = 32, ef_search: int = 128):
         dim = init_reps.shape[1]
-        self.index = faiss.IndexFlatIP(dim)
+        # IVF needs at least one training point per list
+        nlist = max(1, min(nlist, init_reps.shape[0]))
+        self.index_type = index_type
+        self.index = build_index(dim, index_type, nlist=nlist, pq_m=pq_m, pq_bits=pq_bits,
+                                 hnsw_m=hnsw_m, ef_construction=ef_construction)
+        if not self.index.is_trained:
+            self.index.train(np.ascontiguousarray(init_reps, dtype=np.float32))
+        self.set_search_params(nprobe=nprobe, ef_search=ef_search)
+
+    @classmethod
+    def from_config(cls, init_reps: np.ndarray, index_config: dict = None) -> "BaseFaissIPRetriever":
+        """Build from the `index` section of config.json (missing keys keep their defaults)."""
+        index_config = dict(index_config or {})
+        index_type = index_config.pop("type", "flat")
+        known = ("nlist", "pq_m", "pq_bits", "hnsw_m", "ef_construction", "nprobe", "ef_search")
+        return cls(init_reps, index_type=index_type,
+                   **{key: value for key, value in index_config.items() if key in known})
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True, nprobe: int = None,
+             ef_search: int = None) -> "BaseFaissIPRetriever":
+        """
+        Read an index written by `save`. With `mmap`, FAISS maps the vectors of the
+        file read-only (see `_mmap_flags`) so every process serving the same file
+        shares one copy in the page cache.
+        """
+        flags = _mmap_flags(path) if mmap else 0
+        retriever = cls.__new__(cls)
+        retriever.index = faiss.read_index(path, flags)
+        retriever.index_type = _INDEX_CLASSES.get(type(retriever.base_index).__name__, "flat")
+        retriever.set_search_params(nprobe=nprobe, ef_search=ef_search)
+        return retriever
+
+    @property
+    def base_index(self):
+        """The index inside the id map, or the index itself."""
+        if isinstance(self.index, faiss.IndexIDMap):
+            return faiss.downcast_index(self.index.index)
+        return self.index
+
+    @property
+    def has_ids(self) -> bool:
+        if isinstance(self.index, faiss.IndexIDMap):
+            return True
+        ivf = faiss.try_extract_index_ivf(self.index)
+        return ivf is not None and ivf.direct_map.type == faiss.DirectMap.Hashtable
+
+    def _with_index(self, index) -> "BaseFaissIPRetriever":
+        retriever = self.__class__.__new__(self.__class__)
+        retriever.index = index
+        retriever.index_type = self.index_type
+        return retriever
+
+    def clone(self) -> "BaseFaissIPRetriever":
+        """An in-memory copy to modify while this one keeps serving searches."""
+        return self._with_index(faiss.clone_index(self.index))
+
+    def with_ids(self) -> "BaseFaissIPRetriever":
+        """
+        A copy that can add and remove vectors by id, holding the same vectors under their
+        current positions as ids. IVF indexes store ids in their lists already and only get
+        a hash table from id to list entry; flat and HNSW indexes are rebuilt inside an
+        IndexIDMap2 (IndexIDMap renumbers on removal, which IVF lists do not follow).
+        """
+        if self.has_ids:
+            return self.clone()
+        ivf = faiss.try_extract_index_ivf(self.index)
+        if ivf is not None:
+            retriever = self.clone()
+            faiss.extract_index_ivf(retriever.index).set_direct_map_type(faiss.DirectMap.Hashtable)
+            return retriever
+        vectors = self.index.reconstruct_n(0, self.index.ntotal)
+        retriever = self._with_index(faiss.IndexIDMap2(_empty_copy(self.index)))
+        retriever.add_with_ids(vectors, np.arange(len(vectors), dtype=np.int64))
+        return retriever
+
+    def ids(self) -> np.ndarray:
+        if isinstance(self.index, faiss.IndexIDMap):
+            return faiss.vector_to_array(self.index.id_map)
+        invlists = faiss.extract_index_ivf(self.index).invlists
+        return np.concatenate([np.zeros(0, dtype=np.int64)] + [
+            faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+            for l in range(invlists.nlist) if invlists.list_size(l)])
+
+    def save(self, path: str) -> None:
+        faiss.write_index(self.index, path)
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None) -> None:
+        """Trade recall for speed at query time; knobs that don't apply to the index type are ignored."""
+        params = faiss.ParameterSpace()
+        if nprobe is not None and self.index_type in ("ivf_flat", "ivf_pq"):
+            params.set_index_parameter(self.index, "nprobe", nprobe)
+        if ef_search is not None and self.index_type == "hnsw":
+            params.set_index_parameter(self.index, "efSearch", ef_search)
+
+    def add(self, p_reps: np.ndarray, batch_size: int = 65536) -> None:
+        # FAISS takes contiguous float32; converting chunk by chunk keeps a float16 or
+        # memory-mapped matrix from being copied whole
+        for start in range(0, len(p_reps), batch_size):
+            self.index.add(np.ascontiguousarray(p_reps[start:start + batch_size], dtype=np.float32))
+
+    def add_with_ids(self, p_reps: np.ndarray, ids: np.ndarray, batch_size: int = 65536) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        for start in range(0, len(p_reps), batch_size):
+            self.index.add_with_ids(np.ascontiguousarray(p_reps[start:start + batch_size], dtype=np.float32),
+                                    ids[start:start + batch_size])
 
-    def add(self, p_reps: np.ndarray) -> None:
-        self.index.add(p_reps)
+    def remove_ids(self, ids: np.ndarray) -> int:
+        """Drop the vectors with these ids (ids not in the index are ignored); returns how many were removed."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if self.index_type != "hnsw":
+            return self.index.remove_ids(ids)
+        # an HNSW graph cannot drop nodes: rebuild it from the vectors that stay
+        current = self.ids()
+        keep = current[~np.isin(current, ids)]
+        vectors = self.index.reconstruct_batch(keep) if len(keep) else np.zeros((0, self.index.d), np.float32)
+        index = faiss.IndexIDMap2(_empty_copy(self.base_index))
+        index.add_with_ids(vectors, keep)
+        self.index = index
+        return len(current) - len(keep)
 
     def search(self, q_reps: np.ndarray, k: int):
         return self.index.search(q_reps, k)
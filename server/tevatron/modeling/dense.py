@@ -20,6 +20,21 @@ class DenseOutput:
     p_reps: Optional[torch.Tensor] = None
 
 
+class CLSEncoder(nn.Module):
+    """
+    Tensor-in, tensor-out view of a DenseModel's encoder (input_ids, attention_mask ->
+    CLS representations), for exporters and tracers that cannot handle dict inputs.
+    """
+
+    def __init__(self, encoder: PreTrainedModel):
+        super().__init__()
+        self.encoder = encoder
+
+    def forward(self, input_ids, attention_mask):
+        out = self.encoder(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+        return out.last_hidden_state[:, 0]
+
+
 class DenseModel(nn.Module):
     """
     Thin wrapper around a HuggingFace encoder that returns CLS-token
@@ -0,0 +1,102 @@
+"""ONNX Runtime and int8 variants of DenseModel
+
+`export_onnx` writes the CLS-pooling query encoder of a DenseModel to an ONNX
+graph with dynamic batch and sequence axes, `quantize_onnx` derives a dynamic
+int8 copy of it, and `OnnxDenseModel` runs either file with ONNX Runtime behind
+the same call interface as DenseModel. `quantize_dense` is the pure-PyTorch
+alternative (dynamic int8 nn.Linear layers).
+
+onnx / onnxruntime are only imported when these functions are used.
+"""
+
+from __future__ import annotations
+
+import inspect
+from typing import Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from .dense import CLSEncoder, DenseModel, DenseOutput
+
+INPUT_NAMES = ["input_ids", "attention_mask"]
+
+
+def export_onnx(model: DenseModel, path: str, max_length: int = 32, opset: int = 17) -> str:
+    encoder = CLSEncoder(model.encoder).eval()
+    sample = (
+        torch.ones((2, max_length), dtype=torch.long),
+        torch.ones((2, max_length), dtype=torch.long),
+    )
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # the TorchScript exporter: no onnxscript dependency, stable dynamic axes
+        kwargs["dynamo"] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            encoder,
+            sample,
+            path,
+            input_names=INPUT_NAMES,
+            output_names=["q_reps"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "q_reps": {0: "batch"},
+            },
+            opset_version=opset,
+            **kwargs,
+        )
+    return path
+
+
+def quantize_onnx(source: str, target: str) -> str:
+    """Dynamic int8 quantization of the weights of an exported encoder."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(source, target, weight_type=QuantType.QInt8)
+    return target
+
+
+def quantize_dense(model: DenseModel) -> DenseModel:
+    """DenseModel with its nn.Linear layers dynamically quantized to int8 (PyTorch backend)."""
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxDenseModel:
+    """
+    DenseModel look-alike backed by an ONNX Runtime session: called with the
+    tokenizer's output, returns DenseOutput with torch tensors.
+    """
+
+    def __init__(self, path: str, threads: Optional[int] = None, inter_op_threads: Optional[int] = None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.path = path
+        self.session = onnxruntime.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    def with_threads(self, threads: Optional[int] = None,
+                     inter_op_threads: Optional[int] = None) -> "OnnxDenseModel":
+        """A new session on the same file with other thread counts (e.g. in a forked worker)."""
+        return OnnxDenseModel(self.path, threads=threads, inter_op_threads=inter_op_threads)
+
+    def __call__(self, query=None, passage=None) -> DenseOutput:
+        batch = query if query is not None else passage
+        if batch is None:
+            return DenseOutput()
+        feeds = {name: np.asarray(batch[name].cpu().numpy(), dtype=np.int64) for name in self.input_names}
+        reps = torch.from_numpy(self.session.run(None, feeds)[0])
+        if query is not None:
+            return DenseOutput(q_reps=reps)
+        return DenseOutput(p_reps=reps)
+
+    def eval(self) -> "OnnxDenseModel":
+        return self
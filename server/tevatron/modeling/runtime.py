@@ -0,0 +1,64 @@
+"""Inference runtime for query encoders
+
+`InferenceModel` wraps a DenseModel (or OnnxDenseModel) for serving: every call
+runs under `torch.inference_mode()`, and a PyTorch encoder can optionally be
+traced with `torch.jit` or compiled with `torch.compile`. `configure_threads`
+pins torch's intra-op and inter-op thread pools, so that the encoder does not
+oversubscribe cores shared with the web server's request threads.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+import torch
+
+from .dense import CLSEncoder, DenseModel, DenseOutput
+
+COMPILE_MODES = (None, "jit", "compile")
+
+
+def configure_threads(intra_op: Optional[int] = None, inter_op: Optional[int] = None) -> dict:
+    """Apply the thread counts that are set; returns the counts torch ends up with."""
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op and inter_op != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            # only possible before the first inter-op parallel work in this process
+            print(f"Keeping {torch.get_num_interop_threads()} inter-op threads: {e}")
+    return {"intra_op": torch.get_num_threads(), "inter_op": torch.get_num_interop_threads()}
+
+
+class InferenceModel:
+    """Autograd-free, optionally traced/compiled encoder with the DenseModel call interface."""
+
+    def __init__(self, model, compile: Optional[str] = None, max_length: int = 32):
+        if compile not in COMPILE_MODES:
+            raise ValueError(f"Unknown compile mode: {compile}")
+        self.model = model
+        self.compile = compile if isinstance(model, DenseModel) else None
+        self.encoder = None
+        if self.compile == "jit":
+            sample = torch.ones((2, max_length), dtype=torch.long)
+            with torch.no_grad():
+                self.encoder = torch.jit.trace(CLSEncoder(model.encoder).eval(), (sample, sample), strict=False)
+            self.encoder = torch.jit.freeze(self.encoder)
+        elif self.compile == "compile":
+            self.encoder = torch.compile(CLSEncoder(model.encoder).eval(), dynamic=True)
+
+    def __call__(self, query=None, passage=None) -> DenseOutput:
+        with torch.inference_mode():
+            if self.encoder is None:
+                return self.model(query, passage)
+            batch = query if query is not None else passage
+            if batch is None:
+                return DenseOutput()
+            reps = self.encoder(batch["input_ids"], batch["attention_mask"])
+            if query is not None:
+                return DenseOutput(q_reps=reps)
+            return DenseOutput(p_reps=reps)
+
+    def eval(self) -> "InferenceModel":
+        return self
@@ -0,0 +1,50 @@
+"""
+Memory-mapped word2vec store for keyword grouping.
+
+`PubMed-w2v.bin` is in the original word2vec binary format, which gensim has to parse
+vector by vector on every start. Converting it once to gensim's native format lets
+`load_word2vec` open the vector matrix with `mmap='r'`, so startup is a file map and
+every worker process shares the same pages.
+
+    python w2v_store.py Model/PubMed-w2v.bin Model/PubMed-w2v.kv [--limit 2000000] [--fp16]
+"""
+
+import argparse
+import os
+
+import numpy
+from gensim.models import KeyedVectors
+
+
+def convert_word2vec(source, target, limit=None, fp16=False):
+    """
+    Convert a word2vec binary file to gensim's native format at `target`.
+
+    `limit` keeps only the first (most frequent) words of the vocabulary, and `fp16`
+    stores the vectors as float16; both shrink the mapped file.
+    """
+    model_w2v = KeyedVectors.load_word2vec_format(source, binary=True, limit=limit)
+    if fp16:
+        model_w2v.vectors = model_w2v.vectors.astype(numpy.float16)
+    # norms are recomputed lazily and would otherwise be stored (and mapped) too
+    model_w2v.norms = None
+    model_w2v.save(target)
+    return model_w2v
+
+
+def load_word2vec(native_path, binary_path=None):
+    """Map the native store when it exists, otherwise fall back to parsing the binary file."""
+    if os.path.exists(native_path):
+        return KeyedVectors.load(native_path, mmap='r')
+    return KeyedVectors.load_word2vec_format(binary_path, binary=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert PubMed-w2v.bin to a memory-mappable store")
+    parser.add_argument("source", nargs="?", default="Model/PubMed-w2v.bin")
+    parser.add_argument("target", nargs="?", default="Model/PubMed-w2v.kv")
+    parser.add_argument("--limit", type=int, default=None, help="keep only the N most frequent words")
+    parser.add_argument("--fp16", action="store_true", help="store vectors as float16")
+    args = parser.parse_args()
+    converted = convert_word2vec(args.source, args.target, limit=args.limit, fp16=args.fp16)
+    print(f"Saved {len(converted.key_to_index)} vectors to {args.target}")